@@ -3,12 +3,20 @@ from flask_admin import Admin  # Импорт Flask-Admin для создани
 from flask_admin.contrib.sqla import ModelView  # Импорт готовых представлений для моделей SQLAlchemy
 from models import db, Post  # Импорт базы данных и модели Post
 
+import os
+import sys
+# Общий модуль настроек SQLite лежит в каталоге common в корне репозитория
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.sqlite_engine import configure_sqlite
+
 app = Flask(__name__)
 # Настройка приложения: SECRET_KEY для защиты, параметры подключения к базе SQLite
 app.config['SECRET_KEY'] = 'your-secret-key'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///blog_admin.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Общие настройки SQLite: WAL, PRAGMA и пул соединений
+configure_sqlite(app)
 db.init_app(app)
 with app.app_context():
     db.create_all()  # Создание таблиц в базе данных
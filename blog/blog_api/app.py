@@ -3,10 +3,18 @@ from flask_restful import Resource, Api
 from models import db, Post
 from datetime import datetime
 
+import os
+import sys
+# Общий модуль настроек SQLite лежит в каталоге common в корне репозитория
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.sqlite_engine import configure_sqlite
+
 app = Flask(__name__)
 # Настройка подключения к базе данных для API-приложения
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///blog_api.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Общие настройки SQLite: WAL, PRAGMA и пул соединений
+configure_sqlite(app)
 db.init_app(app)
 api = Api(app)
 
@@ -5,12 +5,20 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, TextAreaField, SubmitField
 from wtforms.validators import DataRequired
 
+import os
+import sys
+# Общий модуль настроек SQLite лежит в каталоге common в корне репозитория
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.sqlite_engine import configure_sqlite
+
 app = Flask(__name__)
 # Настройка секретного ключа и параметров подключения к базе данных SQLite
 app.config['SECRET_KEY'] = 'your-secret-key'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///blog_comments.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Общие настройки SQLite: WAL, PRAGMA и пул соединений
+configure_sqlite(app)
 db.init_app(app)
 with app.app_context():
     db.create_all()  # Создаем таблицы в базе, если еще не созданы
@@ -6,6 +6,12 @@ from wtforms import StringField, TextAreaField, SubmitField
 from wtforms.validators import DataRequired
 from flask_caching import Cache
 
+import os
+import sys
+# Общий модуль настроек SQLite лежит в каталоге common в корне репозитория
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.sqlite_engine import configure_sqlite
+
 app = Flask(__name__)
 # Настройка приложения: секретный ключ, база данных SQLite и параметры кеширования
 app.config['SECRET_KEY'] = 'your-secret-key'
@@ -14,6 +20,8 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['CACHE_TYPE'] = 'SimpleCache'
 app.config['CACHE_DEFAULT_TIMEOUT'] = 300
 
+# Общие настройки SQLite: WAL, PRAGMA и пул соединений
+configure_sqlite(app)
 db.init_app(app)
 cache = Cache(app)
 
@@ -0,0 +1 @@
+# Общие модули, которые используют несколько приложений репозитория
@@ -0,0 +1,83 @@
+# Бенчмарк настроек SQLite: пропускная способность чтения и записи при параллельной нагрузке
+# Сравнивает движок с параметрами по умолчанию и движок с настройками из sqlite_engine.py
+#
+# Запуск из корня репозитория:
+#     python -m common.bench_sqlite --readers 8 --writers 4 --seconds 5
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+
+from common.sqlite_engine import engine_options
+
+parser = argparse.ArgumentParser(description='Бенчмарк настроек SQLite')
+parser.add_argument('--readers', type=int, default=8, help='число потоков чтения')
+parser.add_argument('--writers', type=int, default=4, help='число потоков записи')
+parser.add_argument('--seconds', type=float, default=5, help='длительность каждого прогона')
+parser.add_argument('--rows', type=int, default=10000, help='начальное количество строк')
+args = parser.parse_args()
+
+
+# Один прогон: создаём базу, запускаем читателей и писателей и считаем выполненные операции
+def run(name, options):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    engine = create_engine('sqlite:///' + path, **options)
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE items (id INTEGER PRIMARY KEY, body TEXT NOT NULL)'))
+        conn.execute(text('INSERT INTO items (body) VALUES (:body)'),
+                     [{'body': 'x' * 200} for _ in range(args.rows)])
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop = time.perf_counter() + args.seconds
+
+    def reader():
+        done = errors = 0
+        with engine.connect() as conn:
+            while time.perf_counter() < stop:
+                try:
+                    conn.execute(text('SELECT body FROM items WHERE id = :id'),
+                                 {'id': random.randint(1, args.rows)}).scalar()
+                    conn.rollback()
+                    done += 1
+                except Exception:
+                    conn.rollback()
+                    errors += 1
+        with lock:
+            counts['reads'] += done
+            counts['errors'] += errors
+
+    def writer():
+        done = errors = 0
+        while time.perf_counter() < stop:
+            try:
+                # Каждая запись — отдельная транзакция с commit, как в веб-приложении
+                with engine.begin() as conn:
+                    conn.execute(text('INSERT INTO items (body) VALUES (:body)'), {'body': 'y' * 200})
+                done += 1
+            except Exception:
+                errors += 1
+        with lock:
+            counts['writes'] += done
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer) for _ in range(args.writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+    print(f'{name:<14} чтение: {counts["reads"] / elapsed:>9.0f} оп/с   '
+          f'запись: {counts["writes"] / elapsed:>7.0f} оп/с   ошибок: {counts["errors"]}')
+
+
+print(f'Потоков чтения: {args.readers}, записи: {args.writers}, длительность: {args.seconds} с')
+run('по умолчанию', {})
+run('с настройками', engine_options(pool_size=args.readers + args.writers, max_overflow=0))
@@ -0,0 +1,66 @@
+# Ограниченный кэш в памяти процесса (каталог marketplace, имена пользователей forum и т. п.)
+# LRU (least recently used) — при переполнении вытесняется запись, к которой дольше всего не обращались
+# TTL (time to live) — запись считается устаревшей через заданное число секунд
+# OrderedDict хранит порядок ключей и позволяет переносить ключ в конец за O(1)
+# Документация: https://docs.python.org/3/library/collections.html#collections.OrderedDict
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=60):
+        # maxsize — максимальное количество записей в кэше
+        self.maxsize = maxsize
+        # ttl — время жизни записи в секундах
+        self.ttl = ttl
+        # Значения хранятся в виде пар (время истечения, значение)
+        self._data = OrderedDict()
+        # Блокировка нужна, так как Flask обрабатывает запросы в нескольких потоках
+        self._lock = threading.Lock()
+        # Счётчики попаданий и промахов
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        # Возвращаем значение по ключу или None, если записи нет или она устарела
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            # Отмечаем запись как недавно использованную
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        # Сохраняем значение и вытесняем самые старые записи при переполнении
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        # Удаляем запись, если она есть
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        # Полностью очищаем кэш
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        # Статистика кэша для мониторинга
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,94 @@
+# Брокер сообщений «издатель — подписчик» в памяти процесса
+# Используется для живых обновлений (Server-Sent Events): обработчик запроса публикует событие
+# в канал после commit, а все подписчики этого канала получают его в своих очередях.
+#
+# Брокер работает только внутри одного процесса: при нескольких рабочих процессах сервера
+# подписчик получает события, опубликованные в его процессе.
+#
+# Подписка не держит поток: ожидание — threading.Event. Под gevent (gunicorn -k gevent) стандартные
+# примитивы синхронизации заменяются на кооперативные, и тысячи ожидающих подписчиков — это
+# тысячи лёгких гринлетов, а не потоков операционной системы.
+#
+# Использование:
+#     broker = Broker()
+#     with broker.subscribe('topic:1') as subscription:
+#         for event, data in subscription.get(timeout=15):
+#             ...
+#     broker.publish('topic:1', 'post', {'id': 10})
+from collections import defaultdict, deque
+import threading
+
+
+class Subscription:
+    def __init__(self, broker, channel, max_queue):
+        self.broker = broker
+        self.channel = channel
+        # Очередь ещё не прочитанных событий; у медленного подписчика старые события вытесняются
+        self._events = deque(maxlen=max_queue)
+        self._ready = threading.Event()
+
+    def push(self, message):
+        self._events.append(message)
+        self._ready.set()
+
+    def get(self, timeout=None):
+        # Ждём события не дольше timeout секунд и возвращаем все накопившиеся (пустой список по таймауту)
+        if not self._events:
+            self._ready.wait(timeout)
+        # Сбрасываем флаг до чтения очереди: событие, пришедшее во время чтения, снова выставит его
+        self._ready.clear()
+        messages = []
+        while self._events:
+            messages.append(self._events.popleft())
+        return messages
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Broker:
+    def __init__(self, max_queue=100):
+        # max_queue — сколько непрочитанных событий хранить для одного подписчика
+        self.max_queue = max_queue
+        # Подписчики по каналам: канал → множество подписок
+        self._channels = defaultdict(set)
+        self._lock = threading.Lock()
+        # Счётчик опубликованных событий для мониторинга
+        self.published = 0
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.max_queue)
+        with self._lock:
+            self._channels[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def publish(self, channel, event, data):
+        # Рассылаем событие (имя, данные) всем подписчикам канала; возвращаем число получателей
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+            self.published += 1
+        for subscription in subscribers:
+            subscription.push((event, data))
+        return len(subscribers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'channels': len(self._channels),
+                'subscribers': sum(len(subscribers) for subscribers in self._channels.values()),
+                'published': self.published,
+            }
@@ -0,0 +1,84 @@
+# Общие настройки движка SQLite для приложений на Flask-SQLAlchemy
+#
+# По умолчанию SQLite работает в режиме журнала отката (rollback journal) с synchronous=FULL:
+# каждая запись ждёт сброса на диск (fsync), а пишущая транзакция блокирует читателей.
+# Модуль включает WAL (write-ahead log), при котором читатели и писатель не мешают друг другу,
+# и несколько других PRAGMA, ускоряющих работу с базой.
+#
+# Использование (до создания SQLAlchemy(app) или вызова db.init_app(app)):
+#     from common.sqlite_engine import configure_sqlite
+#     configure_sqlite(app)
+#     configure_sqlite(app, pragmas={'synchronous': 'FULL'}, pool_size=10)  # с переопределением
+#
+# Документация по PRAGMA: https://www.sqlite.org/pragma.html
+# Документация по WAL: https://www.sqlite.org/wal.html
+import sqlite3
+
+# PRAGMA, применяемые к каждому новому соединению
+DEFAULT_PRAGMAS = {
+    # WAL — читатели не блокируются пишущей транзакцией, запись идёт последовательно в журнал
+    'journal_mode': 'WAL',
+    # В режиме WAL значение NORMAL безопасно для целостности базы и убирает fsync на каждый commit
+    'synchronous': 'NORMAL',
+    # Чтение файла базы через отображение в память (256 МБ) вместо системных вызовов read()
+    'mmap_size': 268435456,
+    # Кэш страниц соединения; отрицательное значение задаётся в килобайтах (здесь 16 МБ)
+    'cache_size': -16384,
+    # Временные таблицы и индексы (сортировки, GROUP BY) хранятся в памяти, а не на диске
+    'temp_store': 'MEMORY',
+}
+
+# Сколько секунд соединение ждёт освобождения блокировки записи (busy_timeout)
+DEFAULT_BUSY_TIMEOUT = 15
+# Размер пула соединений на один процесс (рабочий процесс сервера)
+# Обычно равен числу потоков, обслуживающих запросы в процессе
+DEFAULT_POOL_SIZE = 8
+# Сколько соединений сверх pool_size можно открыть при пиковой нагрузке
+DEFAULT_MAX_OVERFLOW = 8
+
+
+# Создаём класс соединения sqlite3, который выполняет PRAGMA сразу после открытия
+# sqlite3.connect принимает такой класс в параметре factory
+def make_connection_factory(pragmas):
+    class TunedConnection(sqlite3.Connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            for name, value in pragmas.items():
+                self.execute(f'PRAGMA {name}={value}')
+
+    return TunedConnection
+
+
+# Параметры движка для create_engine() или SQLALCHEMY_ENGINE_OPTIONS
+# pragmas дополняют и переопределяют DEFAULT_PRAGMAS; значение None отключает PRAGMA
+def engine_options(pragmas=None, busy_timeout=DEFAULT_BUSY_TIMEOUT,
+                   pool_size=DEFAULT_POOL_SIZE, max_overflow=DEFAULT_MAX_OVERFLOW, memory=False):
+    merged = dict(DEFAULT_PRAGMAS)
+    merged.update(pragmas or {})
+    merged = {name: value for name, value in merged.items() if value is not None}
+    options = {
+        'connect_args': {
+            # timeout — busy_timeout в секундах для драйвера sqlite3
+            'timeout': busy_timeout,
+            'factory': make_connection_factory(merged),
+        },
+    }
+    # Для базы в памяти SQLAlchemy использует особый пул без настроек размера
+    if not memory:
+        options['pool_size'] = pool_size
+        options['max_overflow'] = max_overflow
+    return options
+
+
+# Подключаем настройки к Flask-приложению
+# Вызывать после указания SQLALCHEMY_DATABASE_URI и до инициализации Flask-SQLAlchemy
+# Собственные параметры приложения в SQLALCHEMY_ENGINE_OPTIONS сохраняются
+def configure_sqlite(app, **overrides):
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+    if not uri.startswith('sqlite'):
+        return
+    memory = uri in ('sqlite://', 'sqlite:///:memory:')
+    options = engine_options(memory=memory, **overrides)
+    current = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    connect_args = {**options.pop('connect_args'), **current.pop('connect_args', {})}
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**options, **current, 'connect_args': connect_args}
@@ -0,0 +1,147 @@
+# Очередь отложенной записи (write-behind) для вставок в SQLite
+#
+# В SQLite одновременно пишет только одно соединение, поэтому при частых мелких commit запросы
+# выстраиваются в очередь за блокировкой записи. Очередь отложенной записи принимает строки от
+# обработчиков запросов и записывает их фоновым потоком пачками: одна транзакция на пачку.
+# Пачка записывается, когда накопилось max_rows строк или прошло interval секунд с первой строки.
+#
+# Пока строка не записана, её можно получить через pending(), чтобы автор сразу видел своё
+# изменение (read-your-writes). При остановке (stop(), в том числе при нормальном завершении
+# процесса через atexit) очередь дописывает всё накопленное. Строки, принятые в последние
+# interval секунд перед аварийным завершением процесса (SIGKILL, сбой), теряются.
+#
+# Использование:
+#     writer = WriteBehindQueue(flush=write_rows, interval=0.05, max_rows=200)
+#     writer.start()
+#     token = writer.submit({'post_id': 1, 'content': '...'})
+#     writer.pending([token])  # {токен: строка} для ещё не записанных строк
+#
+# flush(rows) получает список строк в порядке поступления и должен записать их в одной транзакции
+import atexit
+import logging
+import queue
+import threading
+import time
+import uuid
+
+# Маркер остановки фонового потока
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    def __init__(self, flush, interval=0.05, max_rows=200):
+        # flush — функция записи пачки строк
+        self.flush = flush
+        # interval — сколько секунд ждать дополнительные строки после первой строки пачки
+        self.interval = interval
+        # max_rows — максимальный размер пачки
+        self.max_rows = max_rows
+        self._queue = queue.Queue()
+        # Ещё не записанные строки: токен → строка
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        # Счётчики для мониторинга
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        # Запускаем фоновый поток записи и дописываем очередь при завершении процесса
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        # Останавливаем поток после записи всех уже принятых строк
+        if self.running:
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def submit(self, row):
+        # Ставим строку в очередь и возвращаем токен, по которому её можно найти до записи
+        if not self.running:
+            raise RuntimeError('очередь отложенной записи не запущена')
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._pending[token] = row
+        self._queue.put((token, row))
+        return token
+
+    def pending(self, tokens):
+        # Ещё не записанные в базу строки из переданных токенов: словарь токен → строка
+        with self._lock:
+            return {token: self._pending[token] for token in tokens if token in self._pending}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'written': self.written,
+                'batches': self.batches,
+                'failed': self.failed,
+            }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            # Ждём первую строку пачки без ограничения по времени
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            # Добираем строки, пока пачка не заполнится или не истечёт интервал
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_rows:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+        # Дописываем то, что успели поставить в очередь после маркера остановки
+        rest = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                rest.append(item)
+        for start in range(0, len(rest), self.max_rows):
+            self._write(rest[start:start + self.max_rows])
+
+    def _write(self, batch):
+        rows = [row for _, row in batch]
+        try:
+            self.flush(rows)
+            written = len(rows)
+        except Exception:
+            # Пачка не записалась — пробуем записать строки по одной, чтобы одна ошибочная
+            # строка не потянула за собой остальные
+            logger.exception('не удалось записать пачку из %d строк, записываем по одной', len(rows))
+            written = 0
+            for row in rows:
+                try:
+                    self.flush([row])
+                    written += 1
+                except Exception:
+                    logger.exception('строка потеряна: %r', row)
+        with self._lock:
+            for token, _ in batch:
+                self._pending.pop(token, None)
+            self.written += written
+            self.failed += len(rows) - written
+            self.batches += 1
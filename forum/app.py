@@ -1,24 +1,116 @@
 # Импортируем необходимые модули из стандартной библиотеки Python и Flask
 # Flask — основной класс для создания приложения
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response
+# AppGroup — группа команд Flask CLI (flask forum ...), click — библиотека, на которой построен CLI
+from flask.cli import AppGroup
+import click
 # Flask-SQLAlchemy — расширение для интеграции SQLAlchemy с Flask
 # Документация: https://flask-sqlalchemy.palletsprojects.com/
 from flask_sqlalchemy import SQLAlchemy
+# update, text, tuple_ — конструкции SQLAlchemy для атомарных UPDATE, «сырого» SQL и сравнения пар значений
+from sqlalchemy import update, text, tuple_, event, DDL, insert, func, select
+# Engine — класс движка SQLAlchemy, к нему подключается обработчик новых соединений
+from sqlalchemy.engine import Engine
+# insert диалекта SQLite поддерживает INSERT ... ON CONFLICT DO NOTHING
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+# datetime — модуль для работы с датой и временем
+from datetime import datetime, timezone
+# hashlib — хеш строки запроса для ETag страницы
+import hashlib
+# re — регулярные выражения, используются для разбора поискового запроса
+import re
+# json, islice, groupby, deque и ProcessPoolExecutor — потоковые экспорт и импорт в формате NDJSON
+import json
+from itertools import islice, groupby
+from concurrent.futures import ProcessPoolExecutor
+# math и sqlite3 — математические функции для рейтинга «горячих» тем, если в сборке SQLite их нет
+import math
+import sqlite3
+# escape и Markup — экранирование HTML для безопасного вывода фрагментов с подсветкой
+from markupsafe import escape, Markup
+
+# os и sys — модули стандартной библиотеки для работы с путями и путём поиска модулей
+import os
+import sys
+# Добавляем корень репозитория в путь поиска модулей, чтобы подключить общий модуль common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# configure_sqlite — общие настройки SQLite (WAL, PRAGMA, пул соединений), см. common/sqlite_engine.py
+from common.sqlite_engine import configure_sqlite
+# LRUCache — ограниченный по размеру кэш с временем жизни записей, см. common/lru_cache.py
+from common.lru_cache import LRUCache
+# WriteBehindQueue — очередь отложенной пакетной записи, см. common/write_behind.py
+from common.write_behind import WriteBehindQueue
+# Broker — брокер событий в памяти процесса для живых обновлений, см. common/pubsub.py
+from common.pubsub import Broker
+# Counter — подсчёт новых комментариев по постам и темам в пачке, deque — окно пачек при импорте
+from collections import Counter, deque
 
 # Создаём экземпляр Flask-приложения
 app = Flask(__name__)
 # Устанавливаем секретный ключ, необходимый для работы flash-сообщений и защиты от CSRF-атак
 app.config['SECRET_KEY'] = 'очень_секретный_ключ'
-# Указываем строку подключения к базе данных SQLite
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///forum.db'
+# Указываем строку подключения к базе данных SQLite (переменная окружения FORUM_DATABASE_URI
+# позволяет подключить другую базу, например временную в бенчмарке)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('FORUM_DATABASE_URI', 'sqlite:///forum.db')
 # Отключаем отслеживание изменений объектов для экономии памяти
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Количество тем на одной странице главной страницы
+TOPICS_PER_PAGE = 30
+# Количество постов на странице темы и комментариев на странице поста
+POSTS_PER_PAGE = 20
+COMMENTS_PER_PAGE = 50
+# Сколько соответствий «имя пользователя → id» держать в памяти процесса
+USER_CACHE_SIZE = 10000
+# Количество результатов поиска на странице
+SEARCH_PER_PAGE = 20
+# Сколько строк переносить в поисковый индекс за одну транзакцию при его перестроении
+SEARCH_REBUILD_BATCH = 50000
+# Экспорт и импорт NDJSON: строк, читаемых курсором за раз, строк в одной пачке импорта
+# (одна транзакция) и как часто сообщать о прогрессе
+EXPORT_BATCH = 10000
+IMPORT_BATCH = 5000
+NDJSON_PROGRESS_EVERY = 100000
+# Кэш отрендеренных фрагментов страниц тем и постов: количество записей и время жизни в секундах
+FRAGMENT_CACHE_SIZE = 2000
+FRAGMENT_CACHE_TTL = 600
+# Отложенная запись комментариев (включается переменной окружения FORUM_COMMENT_WRITE_BEHIND=1):
+# комментарии записываются фоновым потоком пачками — раз в COMMENT_FLUSH_INTERVAL секунд
+# или по COMMENT_FLUSH_ROWS штук
+COMMENT_WRITE_BEHIND = os.environ.get('FORUM_COMMENT_WRITE_BEHIND') == '1'
+COMMENT_FLUSH_INTERVAL = 0.05
+COMMENT_FLUSH_ROWS = 200
+# Сколько токенов своих ещё не записанных комментариев хранить в сессии пользователя
+PENDING_COMMENTS_IN_SESSION = 20
+# Живые обновления (Server-Sent Events): как часто отправлять комментарий-пинг неактивному
+# подписчику (секунд), через сколько миллисекунд браузеру переподключаться после обрыва
+# и сколько непрочитанных событий хранить для одного подписчика
+SSE_HEARTBEAT = 15
+SSE_RETRY_MS = 3000
+SSE_MAX_QUEUE = 100
+# Рейтинг «горячих» тем: вклад поста и комментария в активность темы и период полураспада
+# (через HOT_HALF_LIFE_HOURS часов вклад события уменьшается вдвое)
+HOT_POST_WEIGHT = 3.0
+HOT_COMMENT_WEIGHT = 1.0
+HOT_HALF_LIFE_HOURS = 24
+# Количество тем на странице «горячих» тем
+HOT_TOPICS_LIMIT = 30
+
+# Включаем общие настройки SQLite до создания движка базы данных
+configure_sqlite(app)
 
 # Создаём экземпляр SQLAlchemy для работы с базой данных
 # db — объект для взаимодействия с БД
 # Документация: https://flask-sqlalchemy.palletsprojects.com/en/latest/api/
 db = SQLAlchemy(app)
 
+# Кэш «имя пользователя → id»: id пользователя не меняется, поэтому время жизни записи большое
+user_id_cache = LRUCache(maxsize=USER_CACHE_SIZE, ttl=24 * 60 * 60)
+# Кэш HTML-фрагментов со списками постов и комментариев
+# Ключ содержит версию темы или поста, поэтому после изменения старые фрагменты просто не используются
+fragment_cache = LRUCache(maxsize=FRAGMENT_CACHE_SIZE, ttl=FRAGMENT_CACHE_TTL)
+# Брокер живых обновлений: каналы topic:<id> (новые посты) и post:<id> (новые комментарии)
+events = Broker(max_queue=SSE_MAX_QUEUE)
+
 # Определяем модель пользователя (User)
 class User(db.Model):
     # Имя таблицы в базе данных
@@ -41,9 +133,26 @@ class Topic(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     # title — название темы, не может быть пустым
     title = db.Column(db.String(100), nullable=False)
+    # Денормализованные счётчики и время последней активности
+    # Обновляются в той же транзакции, что и добавление поста или комментария,
+    # поэтому главной странице не нужно загружать посты каждой темы
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_activity_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # version — версия списка постов темы, увеличивается при каждом новом посте (используется в ETag)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # hot_score — рейтинг «горячей» темы с учётом затухания активности (см. hot_units)
+    # NULL — в теме ещё не было постов и комментариев
+    hot_score = db.Column(db.Float)
     # posts — связь с постами (один-ко-многим)
     posts = db.relationship('Post', backref='topic', lazy=True)
 
+    # Индекс (last_activity_at, id): главная страница читает темы в порядке индекса,
+    # без сортировки всей таблицы
+    # Индекс (hot_score, id): страница «горячих» тем читает первые N записей индекса
+    __table_args__ = (db.Index('ix_topics_last_activity', 'last_activity_at', 'id'),
+                      db.Index('ix_topics_hot_score', 'hot_score', 'id'))
+
     def __repr__(self):
         return f'<Topic {self.id} {self.title}>'
 
@@ -57,9 +166,18 @@ class Post(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     # topic_id — внешний ключ на тему
     topic_id = db.Column(db.Integer, db.ForeignKey('topics.id'), nullable=False)
+    # version — версия страницы поста, увеличивается при каждом новом комментарии (используется в ETag)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # last_activity_at — время создания поста или последнего комментария (заголовок Last-Modified)
+    last_activity_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # created_at — время создания поста (нужно для пересчёта рейтинга «горячих» тем)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     # comments — связь с комментариями (один-ко-многим)
     comments = db.relationship('Comment', backref='post', lazy=True)
 
+    # Индекс (topic_id, id): страница темы — диапазон индекса в порядке id
+    __table_args__ = (db.Index('ix_posts_topic_id_id', 'topic_id', 'id'),)
+
     def __repr__(self):
         return f'<Post {self.id}>'
 
@@ -73,34 +191,362 @@ class Comment(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     # post_id — внешний ключ на пост
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    # created_at — время создания комментария (нужно для пересчёта рейтинга «горячих» тем)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Индекс (post_id, id): страница комментариев — диапазон индекса в порядке id
+    __table_args__ = (db.Index('ix_comments_post_id_id', 'post_id', 'id'),)
 
     def __repr__(self):
         return f'<Comment {self.id}>'
 
-# Главная страница: список всех тем форума
+# Полнотекстовый индекс постов и комментариев: виртуальная таблица SQLite FTS5
+# Документация: https://www.sqlite.org/fts5.html
+# rowid записи индекса кодирует источник: 2 * id для поста и 2 * id + 1 для комментария,
+# поэтому запись индекса находится по rowid без просмотра всей таблицы
+# topic_id и post_id хранятся без индексирования (UNINDEXED) — только для ссылок в результатах
+FORUM_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS forum_fts USING fts5(
+        content, topic_id UNINDEXED, post_id UNINDEXED,
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    # Триггеры обновляют индекс при каждой вставке, изменении и удалении поста или комментария
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_ai AFTER INSERT ON posts BEGIN
+        INSERT INTO forum_fts(rowid, content, topic_id, post_id)
+        VALUES (2 * new.id, new.content, new.topic_id, new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_ad AFTER DELETE ON posts BEGIN
+        DELETE FROM forum_fts WHERE rowid = 2 * old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_au AFTER UPDATE OF content ON posts BEGIN
+        UPDATE forum_fts SET content = new.content WHERE rowid = 2 * new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS comments_fts_ai AFTER INSERT ON comments BEGIN
+        INSERT INTO forum_fts(rowid, content, topic_id, post_id)
+        VALUES (2 * new.id + 1, new.content,
+                (SELECT topic_id FROM posts WHERE id = new.post_id), new.post_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS comments_fts_ad AFTER DELETE ON comments BEGIN
+        DELETE FROM forum_fts WHERE rowid = 2 * old.id + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS comments_fts_au AFTER UPDATE OF content ON comments BEGIN
+        UPDATE forum_fts SET content = new.content WHERE rowid = 2 * new.id + 1;
+    END""",
+]
+
+# Индекс и триггеры создаются в db.create_all() сразу после таблицы comments
+# (к этому моменту таблица posts уже существует)
+for statement in FORUM_FTS_DDL:
+    event.listen(Comment.__table__, 'after_create', DDL(statement))
+
+# Находим id пользователя по имени или создаём пользователя в текущей транзакции
+# При попадании в кэш запросов к базе нет; иначе — INSERT ... ON CONFLICT DO NOTHING RETURNING id,
+# а если пользователь уже был (конфликт по уникальному имени), ещё один SELECT по индексу
+# Два одновременных поста нового пользователя не падают на уникальном ограничении:
+# второй INSERT ждёт блокировку записи и после фиксации первого просто ничего не вставляет
+def resolve_user_id(username):
+    user_id = user_id_cache.get(username)
+    if user_id is not None:
+        return user_id
+    user_id = db.session.execute(
+        sqlite_insert(User)
+        .values(username=username)
+        .on_conflict_do_nothing(index_elements=['username'])
+        .returning(User.id)
+    ).scalar()
+    if user_id is not None:
+        # Пользователь создан в ещё не зафиксированной транзакции: в кэш его не кладём,
+        # чтобы при откате не осталось id несуществующей записи
+        return user_id
+    user_id = db.session.query(User.id).filter_by(username=username).scalar()
+    user_id_cache.set(username, user_id)
+    return user_id
+
+# Рейтинг «горячих» тем
+# Активность темы в момент now — сумма весов её постов и комментариев, затухающих со временем:
+#     A(now) = Σ w · 2^(-(now - t) / T), где t — время события, T — период полураспада
+# Хранить A нельзя — она меняется каждую секунду. Вместо неё храним не зависящую от now величину
+#     hot_score = log2(Σ w · 2^(t / T)),  тогда A(now) = 2^(hot_score - now / T)
+# Порядок тем по hot_score совпадает с порядком по текущей активности, поэтому первые N тем
+# читаются из индекса (hot_score, id) без пересчёта. Новое событие добавляется к сумме
+# в логарифмической форме: log2(2^a + 2^b) = max(a, b) + log2(1 + 2^(-|a - b|))
+HOT_EPOCH = datetime(2020, 1, 1)
+
+# Время события в периодах полураспада от HOT_EPOCH
+def hot_units(moment):
+    return (moment - HOT_EPOCH).total_seconds() / (HOT_HALF_LIFE_HOURS * 3600)
+
+# Вклад события с весом weight в момент moment в логарифмической форме
+def hot_event(weight, moment):
+    return math.log2(weight) + hot_units(moment)
+
+# Сложение двух рейтингов в логарифмической форме (в Python — для пересчёта)
+def hot_add(score, event_score):
+    if score is None:
+        return event_score
+    return max(score, event_score) + math.log2(1 + 2 ** -abs(score - event_score))
+
+# Текущая активность темы по её рейтингу
+def hot_activity(score, now):
+    return 2 ** (score - hot_units(now)) if score is not None else 0.0
+
+# SQLite собирается с математическими функциями (log2, power) не везде — в сборках без них
+# регистрируем функции Python при открытии соединения
+@event.listens_for(Engine, 'connect')
+def register_math_functions(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    try:
+        dbapi_connection.execute('SELECT log2(1), power(2, 1)')
+    except sqlite3.OperationalError:
+        dbapi_connection.create_function('log2', 1, math.log2, deterministic=True)
+        dbapi_connection.create_function('power', 2, math.pow, deterministic=True)
+
+# Отмечаем активность в теме: атомарно увеличиваем счётчик, обновляем время и рейтинг
+# Изменение выполняется одной командой UPDATE в текущей транзакции (без чтения значения в Python)
+def touch_topic(topic_id, posts=0, comments=0):
+    now = datetime.utcnow()
+    values = dict(post_count=Topic.post_count + posts,
+                  comment_count=Topic.comment_count + comments,
+                  version=Topic.version + posts,
+                  last_activity_at=now)
+    weight = posts * HOT_POST_WEIGHT + comments * HOT_COMMENT_WEIGHT
+    if weight > 0:
+        event_score = hot_event(weight, now)
+        values['hot_score'] = db.case(
+            (Topic.hot_score.is_(None), event_score),
+            else_=func.max(Topic.hot_score, event_score)
+            + func.log2(1 + func.power(2, -func.abs(Topic.hot_score - event_score))),
+        )
+    db.session.execute(update(Topic).where(Topic.id == topic_id).values(**values))
+
+# Отмечаем новые комментарии у поста: увеличиваем версию страницы поста и время активности
+def touch_post(post_id, comments=1):
+    db.session.execute(
+        update(Post)
+        .where(Post.id == post_id)
+        .values(version=Post.version + comments, last_activity_at=datetime.utcnow())
+    )
+
+# Запись пачки комментариев из очереди отложенной записи в одной транзакции:
+# один INSERT с executemany и по одному UPDATE счётчиков на каждый затронутый пост и тему
+def write_comments(rows):
+    with app.app_context():
+        user_ids = {username: resolve_user_id(username) for username in {row['username'] for row in rows}}
+        comment_ids = db.session.execute(insert(Comment).returning(Comment.id, sort_by_parameter_order=True), [
+            {'content': row['content'], 'user_id': user_ids[row['username']], 'post_id': row['post_id']}
+            for row in rows
+        ]).scalars().all()
+        for post_id, count in Counter(row['post_id'] for row in rows).items():
+            touch_post(post_id, comments=count)
+        for topic_id, count in Counter(row['topic_id'] for row in rows).items():
+            touch_topic(topic_id, comments=count)
+        db.session.commit()
+    # Сообщаем подписчикам о комментариях только после фиксации пачки
+    for comment_id, row in zip(comment_ids, rows):
+        publish_comment(row['post_id'], comment_id, row['username'], row['content'])
+
+# Очередь отложенной записи комментариев (None, если режим выключен)
+comment_writer = None
+if COMMENT_WRITE_BEHIND:
+    comment_writer = WriteBehindQueue(write_comments, interval=COMMENT_FLUSH_INTERVAL,
+                                      max_rows=COMMENT_FLUSH_ROWS)
+    comment_writer.start()
+
+# Живые обновления: событие публикуется после commit, поэтому подписчик, получив его,
+# уже может прочитать новую запись из базы
+def publish_post(topic_id, post_id, content):
+    events.publish(f'topic:{topic_id}', 'post', {
+        'id': post_id, 'content': content[:50], 'url': url_for('post_detail', post_id=post_id)})
+
+def publish_comment(post_id, comment_id, username, content):
+    events.publish(f'post:{post_id}', 'comment', {'id': comment_id, 'username': username, 'content': content})
+
+# Поток Server-Sent Events для канала брокера
+# Соединение с базой генератору не нужно: оно возвращается в пул сразу после начала ответа
+# Неактивному подписчику раз в SSE_HEARTBEAT секунд отправляется комментарий-пинг — так прокси
+# не закрывают соединение, а отключившийся клиент обнаруживается при записи и отписывается
+def event_stream(channel):
+    subscription = events.subscribe(channel)
+
+    def generate():
+        with subscription:
+            yield f'retry: {SSE_RETRY_MS}\n\n'
+            while True:
+                messages = subscription.get(timeout=SSE_HEARTBEAT)
+                if not messages:
+                    yield ': ping\n\n'
+                for event, data in messages:
+                    yield f'id: {data["id"]}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Подписка создаётся до ответа, чтобы не пропустить события до первой записи, а генератор
+    # может так и не запуститься (HEAD-запрос, ошибка до начала ответа) — тогда его with не сработает.
+    # Поэтому отписываемся и при закрытии ответа; повторная отписка ничего не делает
+    response.call_on_close(subscription.close)
+    return response
+
+# Свои ещё не записанные комментарии к посту: токены хранятся в сессии автора
+# Токены уже записанных комментариев удаляются из сессии
+def own_pending_comments(post_id):
+    tokens = session.get('pending_comments')
+    if not tokens or comment_writer is None:
+        return []
+    rows = comment_writer.pending(tokens)
+    if len(rows) < len(tokens):
+        session['pending_comments'] = list(rows)
+    return [row for row in rows.values() if row['post_id'] == post_id]
+
+# Условный GET: ETag страницы строится из типа и id объекта, его версии и строки запроса
+# (у разных страниц и форматов одного объекта — разные ETag)
+def page_etag(kind, object_id, version):
+    query_hash = hashlib.sha1(request.query_string).hexdigest()[:12]
+    return f'{kind}-{object_id}-v{version}-{query_hash}'
+
+# Если у клиента актуальная версия страницы, возвращаем ответ 304 Not Modified без обращения
+# к таблицам постов и комментариев; иначе None
+def not_modified(etag, last_modified):
+    # Страницу с непоказанными flash-сообщениями нужно отрендерить заново
+    if '_flashes' in session:
+        return None
+    last_modified = last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        fresh = request.if_modified_since is not None and last_modified <= request.if_modified_since
+    if not fresh:
+        return None
+    return with_validators(app.response_class(status=304), etag, last_modified)
+
+# Добавляем к ответу заголовки ETag и Last-Modified
+# Cache-Control: no-cache — браузер и прокси хранят страницу, но каждый раз проверяют её актуальность
+def with_validators(response, etag, last_modified):
+    response = app.make_response(response)
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+# Главная страница: темы форума, отсортированные по последней активности
 @app.route('/')
 def index():
-    # Получаем все темы из базы данных
-    topics = Topic.query.all()
-    # Передаём список тем в шаблон
-    return render_template('index.html', topics=topics)
+    # Курсор keyset-пагинации: время активности и id последней темы предыдущей страницы
+    before_at = request.args.get('before_at')
+    before_id = request.args.get('before_id', type=int)
+    query = db.session.query(Topic.id, Topic.title, Topic.post_count,
+                             Topic.comment_count, Topic.last_activity_at)
+    if before_at and before_id:
+        try:
+            before_at = datetime.fromisoformat(before_at)
+        except ValueError:
+            return redirect(url_for('index'))
+        query = query.filter(tuple_(Topic.last_activity_at, Topic.id) < (before_at, before_id))
+    # Берём на одну тему больше, чтобы понять, есть ли следующая страница
+    topics = (query.order_by(Topic.last_activity_at.desc(), Topic.id.desc())
+              .limit(TOPICS_PER_PAGE + 1).all())
+    next_page = None
+    if len(topics) > TOPICS_PER_PAGE:
+        topics = topics[:TOPICS_PER_PAGE]
+        last = topics[-1]
+        next_page = {'before_at': last.last_activity_at.isoformat(), 'before_id': last.id}
+    # Передаём страницу тем в шаблон
+    return render_template('index.html', topics=topics, next_page=next_page)
 
-# Страница темы: список всех постов в теме
+# «Горячие» темы: первые HOT_TOPICS_LIMIT тем по рейтингу затухающей активности
+# Читается HOT_TOPICS_LIMIT записей индекса (hot_score, id); JSON — ?format=json
+@app.route('/hot')
+def hot_topics():
+    topics = (db.session.query(Topic.id, Topic.title, Topic.post_count, Topic.comment_count, Topic.hot_score)
+              .filter(Topic.hot_score.isnot(None))
+              .order_by(Topic.hot_score.desc(), Topic.id.desc())
+              .limit(HOT_TOPICS_LIMIT).all())
+    now = datetime.utcnow()
+    if request.args.get('format') == 'json':
+        return jsonify(topics=[{'id': t.id, 'title': t.title, 'post_count': t.post_count,
+                                'comment_count': t.comment_count,
+                                'activity': round(hot_activity(t.hot_score, now), 3),
+                                'url': url_for('topic_detail', topic_id=t.id)} for t in topics])
+    return render_template('hot.html', topics=topics, activity=lambda t: hot_activity(t.hot_score, now))
+
+# Keyset-пагинация по id в хронологическом порядке
+# ?after=<id> — более новые записи (id > after), ?before=<id> — более старые (id < before)
+# Возвращает записи страницы по возрастанию id и курсоры соседних страниц (None, если страницы нет)
+def keyset_page(query, id_column, per_page):
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    if before:
+        # Идём назад по индексу и переворачиваем страницу обратно в хронологический порядок
+        rows = query.filter(id_column < before).order_by(id_column.desc()).limit(per_page + 1).all()
+        has_older = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        # Раз пришли со страницы новее, более новые записи есть
+        has_newer = True
+    else:
+        if after:
+            query = query.filter(id_column > after)
+        # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+        rows = query.order_by(id_column).limit(per_page + 1).all()
+        has_newer = len(rows) > per_page
+        rows = rows[:per_page]
+        has_older = bool(after)
+    older = rows[0].id if rows and has_older else None
+    newer = rows[-1].id if rows and has_newer else None
+    return rows, older, newer
+
+# Страница темы: посты темы постранично (HTML или JSON для бесконечной прокрутки, ?format=json)
 @app.route('/topic/<int:topic_id>')
 def topic_detail(topic_id):
     # Получаем тему по id или возвращаем 404, если не найдено
     topic = Topic.query.get_or_404(topic_id)
-    # Получаем все посты в теме
-    posts = Post.query.filter_by(topic_id=topic.id).all()
-    return render_template('topic.html', topic=topic, posts=posts)
+    # Если страница у клиента не устарела, отвечаем 304, не читая посты
+    etag = page_etag('topic', topic.id, topic.version)
+    cached = not_modified(etag, topic.last_activity_at)
+    if cached:
+        return cached
+    if request.args.get('format') == 'json':
+        posts, older, newer = topic_posts_page(topic.id)
+        response = jsonify(
+            posts=[{'id': p.id, 'content': p.content,
+                    'url': url_for('post_detail', post_id=p.id)} for p in posts],
+            older=url_for('topic_detail', topic_id=topic.id, before=older, format='json') if older else None,
+            newer=url_for('topic_detail', topic_id=topic.id, after=newer, format='json') if newer else None,
+        )
+        return with_validators(response, etag, topic.last_activity_at)
+    # Фрагмент со списком постов берём из кэша или рендерим и кладём в кэш
+    fragment = fragment_cache.get(etag)
+    if fragment is None:
+        posts, older, newer = topic_posts_page(topic.id)
+        fragment = render_template('_topic_posts.html', topic=topic, posts=posts, older=older, newer=newer)
+        fragment_cache.set(etag, fragment)
+    return with_validators(render_template('topic.html', topic=topic, posts_html=Markup(fragment)),
+                           etag, topic.last_activity_at)
+
+# Живые обновления темы: события post о новых постах (Server-Sent Events)
+@app.route('/topic/<int:topic_id>/events')
+def topic_events(topic_id):
+    Topic.query.get_or_404(topic_id)
+    return event_stream(f'topic:{topic_id}')
+
+# Одна страница постов темы по индексу (topic_id, id)
+def topic_posts_page(topic_id):
+    return keyset_page(
+        db.session.query(Post.id, Post.content).filter(Post.topic_id == topic_id),
+        Post.id, POSTS_PER_PAGE)
 
-# Страница поста: просмотр поста и комментариев
+# Одна страница комментариев поста по индексу (post_id, id) вместе с именами авторов
+def post_comments_page(post_id):
+    return keyset_page(
+        db.session.query(Comment.id, Comment.content, User.username)
+        .join(User, User.id == Comment.user_id)
+        .filter(Comment.post_id == post_id),
+        Comment.id, COMMENTS_PER_PAGE)
+
+# Страница поста: просмотр поста и комментариев (комментарии в JSON — ?format=json)
 @app.route('/post/<int:post_id>', methods=['GET', 'POST'])
 def post_detail(post_id):
     # Получаем пост по id или возвращаем 404
     post = Post.query.get_or_404(post_id)
-    # Получаем все комментарии к посту
-    comments = Comment.query.filter_by(post_id=post.id).all()
     if request.method == 'POST':
         # Получаем имя пользователя и текст комментария из формы
         username = request.form.get('username')
@@ -109,19 +555,108 @@ def post_detail(post_id):
         if not username or not content:
             flash('Все поля обязательны для заполнения!')
             return redirect(url_for('post_detail', post_id=post.id))
-        # Находим или создаём пользователя
-        user = User.query.filter_by(username=username).first()
-        if not user:
-            user = User(username=username)
-            db.session.add(user)
-            db.session.commit()
-        # Создаём комментарий
-        comment = Comment(content=content, user_id=user.id, post_id=post.id)
+        if comment_writer is not None:
+            # Режим отложенной записи: комментарий попадёт в базу в ближайшей пачке, а до этого
+            # автор видит его на странице поста по токену из своей сессии
+            token = comment_writer.submit(
+                {'username': username, 'content': content, 'post_id': post.id, 'topic_id': post.topic_id})
+            tokens = session.get('pending_comments', []) + [token]
+            session['pending_comments'] = tokens[-PENDING_COMMENTS_IN_SESSION:]
+            flash('Комментарий добавлен!')
+            return redirect(url_for('post_detail', post_id=post_id))
+        # Находим или создаём пользователя, создаём комментарий и обновляем счётчики темы —
+        # всё в одной транзакции с одним commit
+        comment = Comment(content=content, user_id=resolve_user_id(username), post_id=post.id)
         db.session.add(comment)
+        touch_topic(post.topic_id, comments=1)
+        touch_post(post.id)
+        # flush получает id комментария до commit, чтобы не перечитывать его после фиксации
+        db.session.flush()
+        comment_id = comment.id
         db.session.commit()
+        publish_comment(post_id, comment_id, username, content)
         flash('Комментарий добавлен!')
-        return redirect(url_for('post_detail', post_id=post.id))
-    return render_template('post.html', post=post, comments=comments)
+        return redirect(url_for('post_detail', post_id=post_id))
+    # Свои комментарии, которые ещё ждут записи в очереди; страницу с ними не отдаём из кэша клиента
+    pending = own_pending_comments(post.id)
+    # Если страница у клиента не устарела, отвечаем 304, не читая комментарии
+    etag = page_etag('post', post.id, post.version)
+    cached = None if pending else not_modified(etag, post.last_activity_at)
+    if cached:
+        return cached
+    if request.args.get('format') == 'json':
+        comments, older, newer = post_comments_page(post.id)
+        response = jsonify(
+            comments=[{'id': c.id, 'username': c.username, 'content': c.content} for c in comments],
+            pending=[{'username': row['username'], 'content': row['content']} for row in pending],
+            older=url_for('post_detail', post_id=post.id, before=older, format='json') if older else None,
+            newer=url_for('post_detail', post_id=post.id, after=newer, format='json') if newer else None,
+        )
+        return with_validators(response, etag, post.last_activity_at)
+    # Фрагмент с постом и комментариями берём из кэша или рендерим и кладём в кэш
+    fragment = fragment_cache.get(etag)
+    if fragment is None:
+        comments, older, newer = post_comments_page(post.id)
+        fragment = render_template('_post_comments.html', post=post, comments=comments, older=older, newer=newer)
+        fragment_cache.set(etag, fragment)
+    return with_validators(render_template('post.html', post=post, comments_html=Markup(fragment),
+                                           pending=pending),
+                           etag, post.last_activity_at)
+
+# Живые обновления поста: события comment о новых комментариях (Server-Sent Events)
+@app.route('/post/<int:post_id>/events')
+def post_events(post_id):
+    Post.query.get_or_404(post_id)
+    return event_stream(f'post:{post_id}')
+
+# Превращаем пользовательский ввод в запрос FTS5: каждое слово берётся в кавычки,
+# чтобы символы синтаксиса FTS5 (" * - : и т. п.) не ломали запрос
+def build_match_query(q):
+    words = re.findall(r'\w+', q)
+    return ' '.join(f'"{word}"' for word in words) or None
+
+# Границы подсветки во фрагменте: управляющие символы, которых нет в обычном тексте
+# Фрагмент сначала экранируется целиком, а затем границы заменяются на теги <mark>
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'
+
+def highlight(snippet):
+    html = str(escape(snippet))
+    return Markup(html.replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>'))
+
+# Поиск по постам и комментариям: результаты по релевантности (BM25) с подсвеченными фрагментами
+# HTML-страница или JSON (?format=json)
+@app.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    match = build_match_query(q)
+    rows = []
+    if match:
+        # Берём на один результат больше, чтобы понять, есть ли следующая страница
+        rows = db.session.execute(text(
+            'SELECT f.rowid AS rowid, f.topic_id AS topic_id, f.post_id AS post_id, '
+            "snippet(forum_fts, 0, :start, :end, '…', 16) AS snippet, t.title AS topic_title "
+            'FROM forum_fts f JOIN topics t ON t.id = f.topic_id '
+            'WHERE forum_fts MATCH :match ORDER BY f.rank LIMIT :limit OFFSET :offset'
+        ), {'match': match, 'start': SNIPPET_START, 'end': SNIPPET_END,
+            'limit': SEARCH_PER_PAGE + 1, 'offset': (page - 1) * SEARCH_PER_PAGE}).all()
+    has_next = len(rows) > SEARCH_PER_PAGE
+    results = [{
+        # Нечётный rowid — комментарий, чётный — пост
+        'kind': 'comment' if row.rowid % 2 else 'post',
+        'id': row.rowid // 2,
+        'topic_id': row.topic_id,
+        'topic_title': row.topic_title,
+        'post_id': row.post_id,
+        'snippet': highlight(row.snippet),
+        'topic_url': url_for('topic_detail', topic_id=row.topic_id),
+        'post_url': url_for('post_detail', post_id=row.post_id),
+    } for row in rows[:SEARCH_PER_PAGE]]
+    if request.args.get('format') == 'json':
+        for result in results:
+            result['snippet'] = str(result['snippet'])
+        return jsonify(query=q, page=page, has_next=has_next, results=results)
+    return render_template('search.html', q=q, page=page, has_next=has_next, results=results)
 
 # Создание новой темы
 @app.route('/new_topic', methods=['GET', 'POST'])
@@ -148,18 +683,281 @@ def new_post(topic_id):
         if not username or not content:
             flash('Все поля обязательны для заполнения!')
             return redirect(url_for('new_post', topic_id=topic.id))
-        user = User.query.filter_by(username=username).first()
-        if not user:
-            user = User(username=username)
-            db.session.add(user)
-            db.session.commit()
-        post = Post(content=content, user_id=user.id, topic_id=topic.id)
+        # Находим или создаём пользователя, создаём пост и обновляем счётчики темы в одной транзакции
+        post = Post(content=content, user_id=resolve_user_id(username), topic_id=topic.id)
         db.session.add(post)
+        touch_topic(topic.id, posts=1)
+        # flush получает id поста до commit, чтобы не перечитывать его после фиксации
+        db.session.flush()
+        post_id = post.id
         db.session.commit()
+        publish_post(topic_id, post_id, content)
         flash('Пост добавлен!')
-        return redirect(url_for('topic_detail', topic_id=topic.id))
+        return redirect(url_for('topic_detail', topic_id=topic_id))
     return render_template('new_post.html', topic=topic)
 
+# Добавляем в существующую таблицу недостающие столбцы: db.create_all() создаёт только новые таблицы
+# columns — имя столбца → его определение в ALTER TABLE ... ADD COLUMN; возвращает добавленные имена
+def add_missing_columns(table, columns):
+    existing = {row[1] for row in db.session.execute(text(f'PRAGMA table_info({table})'))}
+    added = [name for name in columns if name not in existing]
+    for name in added:
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {columns[name]}'))
+    return added
+
+# Заполняем столбец времени у строк, созданных до его появления, временем миграции
+# SQLite не добавляет столбец NOT NULL без постоянного значения по умолчанию, поэтому
+# столбец добавляется без ограничения и заполняется отдельной командой в формате SQLAlchemy
+def seed_timestamp(table, column):
+    db.session.execute(text(
+        f"UPDATE {table} SET {column} = strftime('%Y-%m-%d %H:%M:%f000', 'now') WHERE {column} IS NULL"
+    ))
+
+# Столбцы счётчиков тем, индекс активности и индексы постов и комментариев в базах, созданных до их появления
+# Настоящее время последней активности старых тем неизвестно: им проставляется время миграции
+def migrate_topic_counters():
+    add_missing_columns('topics', {'post_count': 'INTEGER NOT NULL DEFAULT 0',
+                                   'comment_count': 'INTEGER NOT NULL DEFAULT 0',
+                                   'last_activity_at': 'DATETIME'})
+    seed_timestamp('topics', 'last_activity_at')
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_topics_last_activity ON topics (last_activity_at, id)'))
+    # Индексы постраничной выборки постов темы и комментариев поста
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_posts_topic_id_id ON posts (topic_id, id)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_comments_post_id_id ON comments (post_id, id)'))
+
+# Команда пересчёта счётчиков тем для баз данных, созданных до их появления
+# Сначала добавляет недостающие столбцы и индексы; время последней активности существующих
+# тем не меняется, новым столбцом оно заполняется временем миграции
+# Запуск: flask --app app rebuild-topic-counters
+@app.cli.command('rebuild-topic-counters')
+def rebuild_topic_counters():
+    migrate_topic_counters()
+    db.session.execute(text(
+        'UPDATE topics SET '
+        'post_count = (SELECT COUNT(*) FROM posts WHERE posts.topic_id = topics.id), '
+        'comment_count = (SELECT COUNT(*) FROM comments JOIN posts ON posts.id = comments.post_id '
+        '                 WHERE posts.topic_id = topics.id)'
+    ))
+    db.session.commit()
+    print('Счётчики тем пересчитаны')
+
+# Столбцы времени, версий страниц и рейтинга в базах, созданных до их появления,
+# вместе со столбцами счётчиков тем (migrate_topic_counters)
+# Время создания старых постов и комментариев неизвестно: им проставляется время миграции,
+# поэтому сразу после миграции такие темы получают рейтинг по времени миграции и дальше остывают
+def migrate_activity_columns():
+    migrate_topic_counters()
+    add_missing_columns('topics', {'version': 'INTEGER NOT NULL DEFAULT 0', 'hot_score': 'FLOAT'})
+    add_missing_columns('posts', {'version': 'INTEGER NOT NULL DEFAULT 0',
+                                  'last_activity_at': 'DATETIME', 'created_at': 'DATETIME'})
+    add_missing_columns('comments', {'created_at': 'DATETIME'})
+    for table, column in (('posts', 'last_activity_at'), ('posts', 'created_at'), ('comments', 'created_at')):
+        seed_timestamp(table, column)
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_topics_hot_score ON topics (hot_score, id)'))
+
+# Команда пересчёта рейтинга «горячих» тем по всем постам и комментариям
+# В базе, созданной до появления рейтинга, сначала добавляет недостающие столбцы и индексы
+# Посты и комментарии читаются потоком (yield_per), рейтинги накапливаются в словаре
+# и записываются одним пакетным UPDATE по первичному ключу
+# Запуск: flask --app app rebuild-hot-scores
+@app.cli.command('rebuild-hot-scores')
+def rebuild_hot_scores():
+    migrate_activity_columns()
+    db.session.commit()
+    scores = {}
+    sources = [
+        (HOT_POST_WEIGHT, db.session.query(Post.topic_id, Post.created_at)),
+        (HOT_COMMENT_WEIGHT, db.session.query(Post.topic_id, Comment.created_at)
+                                       .join(Post, Post.id == Comment.post_id)),
+    ]
+    for weight, query in sources:
+        for topic_id, created_at in query.yield_per(SEARCH_REBUILD_BATCH):
+            scores[topic_id] = hot_add(scores.get(topic_id), hot_event(weight, created_at))
+    db.session.execute(update(Topic).values(hot_score=None))
+    if scores:
+        db.session.execute(update(Topic), [{'id': topic_id, 'hot_score': score}
+                                           for topic_id, score in scores.items()])
+    db.session.commit()
+    print(f'Рейтинг пересчитан для {len(scores)} тем')
+
+# Команда перестроения поискового индекса (в том числе для баз, созданных до его появления)
+# Строки переносятся пачками по диапазонам id, каждая пачка — отдельная транзакция,
+# поэтому даже на миллионах строк журнал и память остаются ограниченными
+# Запуск: flask --app app rebuild-search-index
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    for statement in FORUM_FTS_DDL:
+        db.session.execute(text(statement))
+    db.session.execute(text('DELETE FROM forum_fts'))
+    db.session.commit()
+    fill_search_index()
+    print('Поисковый индекс перестроен')
+
+# Запросы переноса постов и комментариев из диапазона id в поисковый индекс
+SEARCH_INDEX_SOURCES = [
+    ('posts', 'INSERT INTO forum_fts(rowid, content, topic_id, post_id) '
+              'SELECT 2 * id, content, topic_id, id FROM posts WHERE id > :lo AND id <= :hi'),
+    ('comments', 'INSERT INTO forum_fts(rowid, content, topic_id, post_id) '
+                 'SELECT 2 * c.id + 1, c.content, p.topic_id, c.post_id '
+                 'FROM comments c JOIN posts p ON p.id = c.post_id WHERE c.id > :lo AND c.id <= :hi'),
+]
+
+# Переносим в поисковый индекс посты и комментарии с id больше start_ids[таблица] (по умолчанию все)
+def fill_search_index(start_ids=None):
+    start_ids = start_ids or {}
+    for table, statement in SEARCH_INDEX_SOURCES:
+        max_id = db.session.execute(text(f'SELECT COALESCE(MAX(id), 0) FROM {table}')).scalar()
+        for lo in range(start_ids.get(table, 0), max_id, SEARCH_REBUILD_BATCH):
+            db.session.execute(text(statement), {'lo': lo, 'hi': lo + SEARCH_REBUILD_BATCH})
+            db.session.commit()
+            print(f'{table}: {min(lo + SEARCH_REBUILD_BATCH, max_id)} / {max_id}')
+    # Объединяем сегменты индекса для более быстрого поиска
+    db.session.execute(text("INSERT INTO forum_fts(forum_fts) VALUES('optimize')"))
+    db.session.commit()
+
+# Экспорт и импорт базы форума в формате NDJSON (одна JSON-запись на строку):
+#     {"type": "user", "id": 1, "username": "..."}
+#     {"type": "topic", "id": 1, "title": "...", ...}
+# Запуск:
+#     flask --app app forum export forum.ndjson      (без имени файла — в стандартный вывод)
+#     flask --app app forum import forum.ndjson --workers 4
+# Импорт выполняется при остановленном приложении
+forum_cli = AppGroup('forum', help='Экспорт и импорт базы форума в формате NDJSON')
+app.cli.add_command(forum_cli)
+
+# Сущности в порядке выгрузки и их поля: записи, на которые ссылаются user_id, topic_id и post_id,
+# выгружаются раньше ссылающихся на них
+NDJSON_ENTITIES = [
+    ('user', User, ['id', 'username']),
+    ('topic', Topic, ['id', 'title', 'post_count', 'comment_count', 'last_activity_at', 'version', 'hot_score']),
+    ('post', Post, ['id', 'content', 'user_id', 'topic_id', 'version', 'last_activity_at', 'created_at']),
+    ('comment', Comment, ['id', 'content', 'user_id', 'post_id', 'created_at']),
+]
+NDJSON_DATETIME_FIELDS = {'last_activity_at', 'created_at'}
+
+# Генератор записей для выгрузки
+# Строки читаются курсором порциями по EXPORT_BATCH (yield_per), без загрузки таблиц в память
+# и без ORM-объектов в сессии
+def export_records():
+    for kind, model, fields in NDJSON_ENTITIES:
+        rows = db.session.execute(
+            select(*[getattr(model, field) for field in fields])
+            .order_by(model.id)
+            .execution_options(yield_per=EXPORT_BATCH)
+        )
+        for row in rows:
+            record = {'type': kind}
+            for field, value in zip(fields, row):
+                record[field] = value.isoformat() if isinstance(value, datetime) else value
+            yield record
+
+@forum_cli.command('export')
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+def export_forum(output):
+    count = 0
+    for record in export_records():
+        output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        count += 1
+        if count % NDJSON_PROGRESS_EVERY == 0:
+            click.echo(f'Выгружено записей: {count}', err=True)
+    click.echo(f'Выгружено записей: {count}', err=True)
+
+# Разбор пачки строк NDJSON (выполняется в текущем процессе или в процессе-обработчике)
+def parse_ndjson_lines(lines):
+    return [json.loads(line) for line in lines if line.strip()]
+
+# Генератор разобранных пачек по IMPORT_BATCH строк в исходном порядке
+# При workers > 1 пачки разбираются параллельно в нескольких процессах; одновременно в работе
+# не больше 2 * workers пачек, поэтому файл не читается в память целиком
+def parsed_batches(stream, workers):
+    chunks = iter(lambda: list(islice(stream, IMPORT_BATCH)), [])
+    if workers <= 1:
+        for chunk in chunks:
+            yield parse_ndjson_lines(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        window = deque()
+        for chunk in chunks:
+            window.append(pool.submit(parse_ndjson_lines, chunk))
+            if len(window) >= 2 * workers:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+# Импорт записей в текущую базу с переназначением id
+# Каждой таблице назначается сдвиг — наибольший уже занятый id: новая запись получает id + сдвиг,
+# поэтому ссылки пересчитываются без таблицы соответствий (в пустую базу id переносятся как есть)
+# Исключение — пользователи с уже существующими именами: их id запоминаются в user_remap
+# (словарь растёт только на число совпавших имён)
+# Каждая пачка вставляется через executemany и фиксируется отдельной транзакцией
+def import_records(batches):
+    offsets = {kind: db.session.query(func.coalesce(func.max(model.id), 0)).scalar()
+               for kind, model, _ in NDJSON_ENTITIES}
+    user_remap = {}
+
+    def user_id(old_id):
+        return user_remap.get(old_id, old_id + offsets['user'])
+
+    def parse_dates(record):
+        for field in NDJSON_DATETIME_FIELDS & record.keys():
+            record[field] = datetime.fromisoformat(record[field])
+        return record
+
+    converters = {
+        'user': lambda r: {'id': r['id'] + offsets['user'], 'username': r['username']},
+        'topic': lambda r: parse_dates({**r, 'id': r['id'] + offsets['topic']}),
+        'post': lambda r: parse_dates({**r, 'id': r['id'] + offsets['post'], 'user_id': user_id(r['user_id']),
+                                       'topic_id': r['topic_id'] + offsets['topic']}),
+        'comment': lambda r: parse_dates({**r, 'id': r['id'] + offsets['comment'],
+                                          'user_id': user_id(r['user_id']),
+                                          'post_id': r['post_id'] + offsets['post']}),
+    }
+    tables = {kind: model.__table__ for kind, model, _ in NDJSON_ENTITIES}
+    counts = Counter()
+    for batch in batches:
+        # Внутри пачки записи одного типа идут подряд; вставляем их группами в исходном порядке
+        for kind, records in groupby(batch, key=lambda r: r.pop('type')):
+            records = list(records)
+            rows = [converters[kind](r) for r in records]
+            if kind == 'user':
+                db.session.execute(sqlite_insert(tables[kind]).on_conflict_do_nothing(), rows)
+                if offsets['user']:
+                    # Имена, которые уже были в базе, сохранили свои id — запоминаем соответствие
+                    existing = dict(db.session.execute(
+                        select(User.username, User.id).where(User.username.in_([r['username'] for r in rows]))
+                    ).all())
+                    for record, row in zip(records, rows):
+                        if existing[row['username']] != row['id']:
+                            user_remap[record['id']] = existing[row['username']]
+            else:
+                db.session.execute(insert(tables[kind]), rows)
+            counts[kind] += len(rows)
+        db.session.commit()
+        total = sum(counts.values())
+        if total // NDJSON_PROGRESS_EVERY != (total - len(batch)) // NDJSON_PROGRESS_EVERY:
+            click.echo(f'Загружено записей: {total}', err=True)
+    return offsets, counts
+
+@forum_cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8'), default='-')
+@click.option('--workers', default=1, show_default=True, help='Число процессов для разбора JSON')
+def import_forum(source, workers):
+    # В пустой базе сначала создаём таблицы, иначе загрузка упадёт на первой вставке
+    db.create_all()
+    # Поисковый индекс заполняем одним проходом после загрузки, а не триггером на каждую строку
+    db.session.execute(text('DROP TRIGGER IF EXISTS posts_fts_ai'))
+    db.session.execute(text('DROP TRIGGER IF EXISTS comments_fts_ai'))
+    db.session.commit()
+    try:
+        offsets, counts = import_records(parsed_batches(source, workers))
+    finally:
+        for statement in FORUM_FTS_DDL:
+            db.session.execute(text(statement))
+        db.session.commit()
+    fill_search_index({'posts': offsets['post'], 'comments': offsets['comment']})
+    click.echo('Загружено: ' + ', '.join(f'{kind}: {counts[kind]}' for kind, _, _ in NDJSON_ENTITIES))
+
 # Запуск приложения только если файл запущен напрямую
 if __name__ == '__main__':
     # Создаём все таблицы в базе данных, если их ещё нет
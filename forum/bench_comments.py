@@ -0,0 +1,104 @@
+# Бенчмарк добавления комментариев: запись каждого комментария своим commit
+# против отложенной пакетной записи (FORUM_COMMENT_WRITE_BEHIND=1)
+# Много потоков одновременно комментируют посты одной темы; выводится число комментариев в секунду
+# и проверяется, что все комментарии и счётчики записаны
+#
+# Запуск из каталога forum:
+#     python bench_comments.py --threads 16 --comments 200
+# Без --mode запускает оба режима по очереди и сравнивает их
+# Бенчмарк работает с временной базой данных и не трогает forum.db
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Разбираем аргументы командной строки
+parser = argparse.ArgumentParser(description='Бенчмарк записи комментариев форума')
+parser.add_argument('--threads', type=int, default=16, help='число параллельных авторов')
+parser.add_argument('--comments', type=int, default=200, help='комментариев на один поток')
+parser.add_argument('--posts', type=int, default=10, help='число постов, которые комментируют')
+parser.add_argument('--mode', choices=['sync', 'write-behind'], help='режим записи (по умолчанию оба)')
+args = parser.parse_args()
+
+if args.mode is None:
+    # Каждый режим запускаем в отдельном процессе: режим выбирается при импорте приложения
+    results = {}
+    for mode in ('sync', 'write-behind'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--threads', str(args.threads), '--comments', str(args.comments),
+             '--posts', str(args.posts), '--mode', mode],
+            capture_output=True, text=True, check=True).stdout
+        print(output, end='')
+        results[mode] = float(output.rsplit('RATE=', 1)[1])
+    print(f'Ускорение отложенной записи: {results["write-behind"] / results["sync"]:.1f}x')
+    sys.exit(0)
+
+# Подключаем приложение к временной базе до его импорта
+db_dir = tempfile.mkdtemp()
+os.environ['FORUM_DATABASE_URI'] = 'sqlite:///' + os.path.join(db_dir, 'bench.db')
+if args.mode == 'write-behind':
+    os.environ['FORUM_COMMENT_WRITE_BEHIND'] = '1'
+
+from app import app, db, Topic, Post, Comment, comment_writer
+
+with app.app_context():
+    db.create_all()
+client = app.test_client()
+client.post('/new_topic', data={'title': 'Бенчмарк'})
+for i in range(args.posts):
+    client.post('/topic/1/new_post', data={'username': 'author', 'content': f'Пост {i}'})
+
+# Счётчик ответов с ошибкой (общий для всех потоков)
+lock = threading.Lock()
+errors = [0]
+
+def commenter(n):
+    # У каждого потока свой тестовый клиент и несколько постоянных имён пользователей
+    client = app.test_client()
+    for i in range(args.comments):
+        response = client.post(f'/post/{i % args.posts + 1}', data={
+            'username': f'user{n % 4}',
+            'content': f'Комментарий {n}-{i}',
+        })
+        if response.status_code != 302:
+            with lock:
+                errors[0] += 1
+
+threads = [threading.Thread(target=commenter, args=(n,)) for n in range(args.threads)]
+started = time.perf_counter()
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+answered = time.perf_counter() - started
+# В режиме отложенной записи дожидаемся записи всей очереди: время до сохранения всех комментариев
+if comment_writer is not None:
+    comment_writer.stop()
+elapsed = time.perf_counter() - started
+
+total = args.threads * args.comments
+with app.app_context():
+    stored = db.session.query(Comment).count()
+    topic_comments = db.session.get(Topic, 1).comment_count
+    post_versions = db.session.query(db.func.sum(Post.version)).scalar()
+
+print(f'[{args.mode}] комментариев: {total}, записано: {stored}, ошибок: {errors[0]}')
+print(f'[{args.mode}] ответы на запросы: {answered:.2f} с, все комментарии в базе: {elapsed:.2f} с')
+if comment_writer is not None:
+    print(f'[{args.mode}] пачек: {comment_writer.stats()["batches"]}')
+
+# Проверки: все комментарии записаны, счётчики темы и версии постов совпадают с их числом
+failures = []
+if stored != total:
+    failures.append('записаны не все комментарии')
+if topic_comments != total or post_versions != total:
+    failures.append('счётчики не совпадают с числом комментариев')
+if errors[0]:
+    failures.append('часть запросов завершилась ошибкой')
+if failures:
+    print('ПРОВАЛ: ' + '; '.join(failures))
+    sys.exit(1)
+print(f'[{args.mode}] {total / elapsed:.0f} комментариев/с RATE={total / elapsed:.1f}')
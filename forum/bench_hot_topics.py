@@ -0,0 +1,120 @@
+# Бенчмарк рейтинга «горячих» тем
+# Заполняет временную базу темами, постами и комментариями за последние --days дней и измеряет:
+# - полный пересчёт рейтинга (flask rebuild-hot-scores);
+# - стоимость одного инкрементального обновления (touch_topic + commit);
+# - выборку первых N тем по индексу против расчёта затухающей активности через GROUP BY;
+# и проверяет, что инкрементальные рейтинги совпадают с пересчитанными с нуля
+#
+# Запуск из каталога forum:
+#     python bench_hot_topics.py --topics 2000 --posts 50000 --comments 150000
+# Бенчмарк работает с временной базой данных и не трогает forum.db
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Разбираем аргументы командной строки
+parser = argparse.ArgumentParser(description='Бенчмарк рейтинга «горячих» тем')
+parser.add_argument('--topics', type=int, default=2000, help='число тем')
+parser.add_argument('--posts', type=int, default=50000, help='число постов')
+parser.add_argument('--comments', type=int, default=150000, help='число комментариев')
+parser.add_argument('--days', type=int, default=30, help='за сколько дней распределена активность')
+parser.add_argument('--updates', type=int, default=2000, help='число инкрементальных обновлений')
+parser.add_argument('--requests', type=int, default=200, help='число запросов к странице «горячих» тем')
+args = parser.parse_args()
+
+# Подключаем приложение к временной базе до его импорта
+db_dir = tempfile.mkdtemp()
+os.environ['FORUM_DATABASE_URI'] = 'sqlite:///' + os.path.join(db_dir, 'bench.db')
+
+from sqlalchemy import insert, text
+from app import (app, db, User, Topic, Post, Comment, touch_topic, HOT_TOPICS_LIMIT,
+                 HOT_POST_WEIGHT, HOT_COMMENT_WEIGHT, HOT_HALF_LIFE_HOURS)
+
+random.seed(1)
+now = datetime.utcnow()
+
+def random_moment():
+    return now - timedelta(seconds=random.uniform(0, args.days * 24 * 3600))
+
+# Заполняем базу пакетными вставками
+with app.app_context():
+    db.create_all()
+    db.session.execute(insert(User), [{'username': 'bench'}])
+    db.session.execute(insert(Topic), [{'title': f'Тема {i}'} for i in range(args.topics)])
+    db.session.execute(insert(Post), [
+        {'content': f'Пост {i}', 'user_id': 1, 'topic_id': random.randint(1, args.topics),
+         'created_at': random_moment()} for i in range(args.posts)])
+    db.session.execute(insert(Comment), [
+        {'content': f'Комментарий {i}', 'user_id': 1, 'post_id': random.randint(1, args.posts),
+         'created_at': random_moment()} for i in range(args.comments)])
+    db.session.commit()
+print(f'База: {args.topics} тем, {args.posts} постов, {args.comments} комментариев')
+
+runner = app.test_cli_runner()
+
+def rebuild():
+    result = runner.invoke(args=['rebuild-hot-scores'])
+    assert result.exit_code == 0, result.output
+
+def scores():
+    with app.app_context():
+        return dict(db.session.query(Topic.id, Topic.hot_score).all())
+
+# Полный пересчёт
+started = time.perf_counter()
+rebuild()
+print(f'Пересчёт рейтинга: {time.perf_counter() - started:.2f} с')
+
+# Инкрементальные обновления: одна команда UPDATE и commit на событие
+with app.app_context():
+    started = time.perf_counter()
+    for _ in range(args.updates):
+        touch_topic(random.randint(1, args.topics), comments=1)
+        db.session.commit()
+    elapsed = time.perf_counter() - started
+    db.session.rollback()
+print(f'Инкрементальное обновление: {elapsed / args.updates * 1e6:.0f} мкс (с commit)')
+
+# Страница «горячих» тем против GROUP BY по всем постам и комментариям
+client = app.test_client()
+started = time.perf_counter()
+for _ in range(args.requests):
+    top = client.get('/hot?format=json').json['topics']
+indexed = (time.perf_counter() - started) / args.requests
+group_by = text(
+    'SELECT topic_id, SUM(w * power(2, -(:now - t) / :half)) AS activity FROM ('
+    '  SELECT topic_id, :post_weight AS w, (julianday(created_at) - 2440587.5) * 24 AS t FROM posts'
+    '  UNION ALL'
+    '  SELECT p.topic_id, :comment_weight, (julianday(c.created_at) - 2440587.5) * 24'
+    '  FROM comments c JOIN posts p ON p.id = c.post_id'
+    ') GROUP BY topic_id ORDER BY activity DESC LIMIT :limit')
+with app.app_context():
+    started = time.perf_counter()
+    db.session.execute(group_by, {
+        'now': (now - datetime(1970, 1, 1)).total_seconds() / 3600, 'half': HOT_HALF_LIFE_HOURS,
+        'post_weight': HOT_POST_WEIGHT, 'comment_weight': HOT_COMMENT_WEIGHT, 'limit': HOT_TOPICS_LIMIT,
+    }).all()
+    grouped = time.perf_counter() - started
+print(f'Первые {HOT_TOPICS_LIMIT} тем: по индексу {indexed * 1000:.2f} мс (весь запрос), '
+      f'GROUP BY {grouped * 1000:.0f} мс (только SQL)')
+
+# Проверка: после пересчёта добавляем посты и комментарии через приложение
+# и сравниваем инкрементальные рейтинги с пересчитанными с нуля
+rebuild()
+for i in range(200):
+    topic_id = random.randint(1, args.topics)
+    client.post(f'/topic/{topic_id}/new_post', data={'username': 'bench', 'content': 'новый пост'})
+    client.post(f'/post/{random.randint(1, args.posts)}', data={'username': 'bench', 'content': 'новый'})
+incremental = scores()
+rebuild()
+rebuilt = scores()
+mismatched = [topic_id for topic_id, score in rebuilt.items()
+              if score is not None and abs(score - incremental[topic_id]) > 1e-6]
+if mismatched:
+    print(f'ПРОВАЛ: рейтинги {len(mismatched)} тем расходятся с пересчитанными')
+    sys.exit(1)
+print('OK: инкрементальные рейтинги совпадают с пересчитанными')
@@ -1,24 +1,87 @@
 # Импортируем необходимые модули из стандартной библиотеки Python и Flask
 # Flask — основной класс для создания приложения
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort
+# json — модуль стандартной библиотеки для разбора JSON и JSONL
+import json
+# re — регулярные выражения, используются для разбора поискового запроса
+import re
+# datetime — модуль для работы с датой и временем
+from datetime import datetime, timedelta
+# click — библиотека, на которой построен Flask CLI (параметры команд)
+import click
+# zip_longest — попарный разбор полей формы разной длины, count — источник версий товаров в кэше
+from itertools import zip_longest, count
 # Flask-SQLAlchemy — расширение для интеграции SQLAlchemy с Flask
 # Документация: https://flask-sqlalchemy.palletsprojects.com/
 from flask_sqlalchemy import SQLAlchemy
+# joinedload и selectinload — стратегии «жадной» загрузки связей SQLAlchemy
+# Документация: https://docs.sqlalchemy.org/en/20/orm/queryguide/relationships.html
+from sqlalchemy.orm import joinedload, selectinload
+# insert — конструкция SQLAlchemy для пакетной вставки строк одним запросом
+from sqlalchemy import insert, update, event, text, DDL, case, func, tuple_
+# insert диалекта SQLite поддерживает INSERT ... ON CONFLICT DO UPDATE (upsert)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# os и sys — модули стандартной библиотеки для работы с путями и путём поиска модулей
+import os
+import sys
+# Добавляем корень репозитория в путь поиска модулей, чтобы подключить общий модуль common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# configure_sqlite — общие настройки SQLite (WAL, PRAGMA, пул соединений), см. common/sqlite_engine.py
+from common.sqlite_engine import configure_sqlite
+# LRUCache — ограниченный по размеру кэш с временем жизни записей, см. common/lru_cache.py
+from common.lru_cache import LRUCache
 
 # Создаём экземпляр Flask-приложения
 app = Flask(__name__)
 # Устанавливаем секретный ключ, необходимый для работы flash-сообщений и защиты от CSRF-атак
 app.config['SECRET_KEY'] = 'очень_секретный_ключ'
 # Указываем строку подключения к базе данных SQLite
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///marketplace.db'
+# Переменная окружения MARKETPLACE_DATABASE_URI позволяет подключить другую БД (например, для стресс-теста)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('MARKETPLACE_DATABASE_URI', 'sqlite:///marketplace.db')
 # Отключаем отслеживание изменений объектов для экономии памяти
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Количество заказов на одной странице истории заказов
+ORDERS_PER_PAGE = 20
+# Максимальное количество заказов в одном запросе массового импорта
+MAX_IMPORT_ORDERS = 10000
+# Параметры кэша каталога: максимальное число записей и время жизни записи в секундах
+app.config['CATALOG_CACHE_SIZE'] = 1024
+app.config['CATALOG_CACHE_TTL'] = 300
+# Количество товаров на одной странице каталога
+PRODUCTS_PER_PAGE = 30
+# Ценовые диапазоны для фильтра каталога: верхние границы (не включительно), None — без границы
+PRICE_BUCKETS = [100, 500, 1000, 5000, None]
+# Количество результатов поиска на странице и в подсказках (typeahead)
+SEARCH_PER_PAGE = 20
+TYPEAHEAD_LIMIT = 10
+# Максимальное количество результатов, которое можно запросить у API подсказок
+TYPEAHEAD_MAX_LIMIT = 50
+# Количество строк в каждом разделе отчёта о продажах и глубина дневной статистики по умолчанию
+REPORT_LIMIT = 20
+REPORT_DAYS = 30
+
+# Включаем общие настройки SQLite до создания движка базы данных
+configure_sqlite(app)
 
 # Создаём экземпляр SQLAlchemy для работы с базой данных
 # db — объект для взаимодействия с БД
 # Документация: https://flask-sqlalchemy.palletsprojects.com/en/latest/api/
 db = SQLAlchemy(app)
 
+# Кэш каталога: страницы каталога, счётчики фильтров и отдельные товары
+# Товары меняются редко, поэтому почти все запросы к витрине обслуживаются из памяти
+catalog_cache = LRUCache(maxsize=app.config['CATALOG_CACHE_SIZE'], ttl=app.config['CATALOG_CACHE_TTL'])
+# Версия каталога входит в ключи страниц кэша; при добавлении товара версия
+# увеличивается, и все закэшированные страницы каталога разом становятся неактуальными
+catalog_version = 0
+# Версии отдельных товаров: id товара → версия, входящая в ключ товара в кэше
+# При сбросе товар получает новую версию из общего счётчика (next() атомарен), поэтому строка,
+# прочитанная до фиксации заказа и положенная в кэш уже после сброса, попадает под старый ключ
+# и больше не читается
+product_versions = {}
+product_version_counter = count(1)
+
 # Определяем модель пользователя (User)
 class User(db.Model):
     # Имя таблицы в базе данных
@@ -37,27 +100,116 @@ class User(db.Model):
 class Product(db.Model):
     __tablename__ = 'products'
     id = db.Column(db.Integer, primary_key=True)
-    # name — название товара, не может быть пустым
-    name = db.Column(db.String(100), nullable=False)
+    # name — название товара, не может быть пустым (индекс нужен для поиска по началу названия)
+    name = db.Column(db.String(100), nullable=False, index=True)
     # description — описание товара
     description = db.Column(db.Text, nullable=True)
     # price — цена товара, не может быть пустой
     price = db.Column(db.Float, nullable=False)
+    # stock — остаток товара на складе; ограничение CHECK не даёт ему уйти в минус
+    stock = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     # orders — связь с заказанными товарами (через OrderItem)
     order_items = db.relationship('OrderItem', backref='product', lazy=True)
 
+    __table_args__ = (
+        db.CheckConstraint('stock >= 0', name='ck_products_stock_non_negative'),
+        # Индекс по цене: фильтр по ценовому диапазону и сортировка по цене
+        db.Index('ix_products_price', 'price'),
+        # Покрывающий индекс (название, цена): счётчики ценовых диапазонов для фильтра по началу названия
+        db.Index('ix_products_name_price', 'name', 'price'),
+    )
+
     def __repr__(self):
         return f'<Product {self.id} {self.name}>'
 
+# Номер ценового диапазона для цены
+def price_bucket(price):
+    for n, upper in enumerate(PRICE_BUCKETS):
+        if upper is None or price < upper:
+            return n
+
+# То же вычисление номера диапазона в виде SQL-выражения CASE для группировки в запросе
+def price_bucket_expr():
+    return case(
+        *[(Product.price < upper, n) for n, upper in enumerate(PRICE_BUCKETS) if upper is not None],
+        else_=len(PRICE_BUCKETS) - 1,
+    )
+
+# Границы ценового диапазона: (нижняя включительно, верхняя не включительно или None)
+def bucket_bounds(n):
+    lower = PRICE_BUCKETS[n - 1] if n > 0 else None
+    return lower, PRICE_BUCKETS[n]
+
+# Подпись ценового диапазона для фильтра, например «< 100» или «100–500»
+def bucket_label(n):
+    lower, upper = bucket_bounds(n)
+    if lower is None:
+        return f'< {upper}'
+    if upper is None:
+        return f'≥ {lower}'
+    return f'{lower}–{upper}'
+
+# Заранее посчитанное количество товаров в каждом ценовом диапазоне
+# Обновляется в add_product в той же транзакции, что и вставка товара
+class PriceFacet(db.Model):
+    __tablename__ = 'price_facets'
+    # bucket — номер диапазона из PRICE_BUCKETS
+    bucket = db.Column(db.Integer, primary_key=True)
+    product_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<PriceFacet {self.bucket} {self.product_count}>'
+
+# Полнотекстовый индекс товаров: виртуальная таблица SQLite FTS5
+# content='products' — индекс не хранит копию текста, а ссылается на строки таблицы products
+# prefix='2 3' — дополнительные индексы префиксов для быстрого поиска по началу слова
+# Документация: https://www.sqlite.org/fts5.html
+PRODUCTS_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description,
+        content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    # Триггеры поддерживают индекс в актуальном состоянии при изменении товаров
+    # Триггер на UPDATE срабатывает только при изменении названия или описания,
+    # поэтому списание остатков при заказе не перестраивает индекс
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+# Создаём индекс и триггеры сразу после создания таблицы products в db.create_all()
+for statement in PRODUCTS_FTS_DDL:
+    event.listen(Product.__table__, 'after_create', DDL(statement))
+
 # Определяем модель заказа (Order)
 class Order(db.Model):
     __tablename__ = 'orders'
     id = db.Column(db.Integer, primary_key=True)
     # user_id — внешний ключ на пользователя
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # created_at — дата и время оформления заказа
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # total — сумма заказа по ценам на момент оформления (считается один раз при оформлении)
+    total = db.Column(db.Float, nullable=False, default=0)
+    # item_count — общее количество единиц товара в заказе
+    item_count = db.Column(db.Integer, nullable=False, default=0)
     # order_items — связь с товарами в заказе (один-ко-многим)
     order_items = db.relationship('OrderItem', backref='order', lazy=True)
 
+    # Составной индекс (user_id, id): история заказов пользователя — один проход по диапазону индекса,
+    # уже упорядоченный по id, без сортировки и без чтения чужих заказов
+    __table_args__ = (db.Index('ix_orders_user_id_id', 'user_id', 'id'),)
+
     def __repr__(self):
         return f'<Order {self.id}>'
 
@@ -65,31 +217,246 @@ class Order(db.Model):
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
     id = db.Column(db.Integer, primary_key=True)
-    # order_id — внешний ключ на заказ
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    # order_id — внешний ключ на заказ (индекс ускоряет подгрузку позиций заказов)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
     # product_id — внешний ключ на товар
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     # quantity — количество товара в заказе
     quantity = db.Column(db.Integer, nullable=False, default=1)
+    # price — цена товара на момент оформления заказа (у старых заказов может быть пустой)
+    price = db.Column(db.Float, nullable=True)
 
     def __repr__(self):
         return f'<OrderItem {self.id}>'
 
-# Главная страница: список всех товаров
+# Сводные таблицы продаж обновляются в той же транзакции, что и оформление заказа,
+# поэтому отчёты читают готовые итоги, а не перебирают все заказы
+# Продажи по товарам: проданное количество и выручка
+class ProductSales(db.Model):
+    __tablename__ = 'product_sales'
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    # Индекс по выручке позволяет получить топ товаров без сортировки всей таблицы
+    revenue = db.Column(db.Float, nullable=False, default=0, index=True)
+    product = db.relationship('Product')
+
+    def __repr__(self):
+        return f'<ProductSales {self.product_id}>'
+
+# Покупки по пользователям: количество заказов и сумма покупок
+class UserSales(db.Model):
+    __tablename__ = 'user_sales'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    orders_count = db.Column(db.Integer, nullable=False, default=0)
+    spend = db.Column(db.Float, nullable=False, default=0, index=True)
+    user = db.relationship('User')
+
+    def __repr__(self):
+        return f'<UserSales {self.user_id}>'
+
+# Итоги по дням: количество заказов, проданных единиц и выручка
+class DailySales(db.Model):
+    __tablename__ = 'daily_sales'
+    day = db.Column(db.Date, primary_key=True)
+    orders_count = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DailySales {self.day}>'
+
+# Преобразуем товар в словарь для хранения в кэше
+# В кэше лежат простые словари, а не ORM-объекты, привязанные к сессии конкретного запроса
+def product_to_dict(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'description': product.description,
+        'price': product.price,
+        'stock': product.stock,
+    }
+
+# Один товар по id через кэш; None, если товара нет (отсутствие товара не кэшируется)
+# Версия берётся до чтения из базы: если заказ зафиксирован позже, сброс сменит версию
+def get_product(product_id):
+    key = f'product:{product_id}:v{product_versions.get(product_id, 0)}'
+    product = catalog_cache.get(key)
+    if product is None:
+        row = db.session.get(Product, product_id)
+        if row is None:
+            return None
+        product = product_to_dict(row)
+        catalog_cache.set(key, product)
+    return product
+
+# Сбрасываем кэш товаров, остаток которых изменился после оформления заказа (вызывается после commit)
+# Товар получает новую версию, записи со старой версией вытесняются из LRU
+def invalidate_products(product_ids):
+    for pid in set(product_ids):
+        product_versions[pid] = next(product_version_counter)
+
+# Варианты сортировки каталога: столбец сортировки и направление (True — по убыванию)
+# Для каждого варианта есть индекс, а id используется как второй ключ для однозначного порядка
+CATALOG_SORTS = {
+    'new': (None, True),
+    'price': (Product.price, False),
+    'price_desc': (Product.price, True),
+    'name': (Product.name, False),
+}
+
+# Страница каталога с фильтрами и keyset-пагинацией
+# after_key и after_id — значение столбца сортировки и id последнего товара предыдущей страницы
+def query_product_page(sort, bucket, prefix, after_key, after_id):
+    column, descending = CATALOG_SORTS[sort]
+    query = db.session.query(Product.id, Product.name, Product.price)
+    if bucket is not None:
+        lower, upper = bucket_bounds(bucket)
+        if lower is not None:
+            query = query.filter(Product.price >= lower)
+        if upper is not None:
+            query = query.filter(Product.price < upper)
+    if prefix:
+        query = query.filter(prefix_filter(Product.name, prefix))
+    if column is None:
+        # Сортировка только по id (новые товары первыми)
+        if after_id is not None:
+            query = query.filter(Product.id < after_id)
+        query = query.order_by(Product.id.desc())
+    else:
+        # Сравнение пар (значение, id) продолжает список ровно с места остановки
+        if after_id is not None and after_key is not None:
+            key = tuple_(column, Product.id)
+            query = query.filter(key < (after_key, after_id) if descending else key > (after_key, after_id))
+        if descending:
+            query = query.order_by(column.desc(), Product.id.desc())
+        else:
+            query = query.order_by(column, Product.id)
+    rows = query.limit(PRODUCTS_PER_PAGE + 1).all()
+    return [{'id': row.id, 'name': row.name, 'price': row.price} for row in rows]
+
+# Количество товаров в каждом ценовом диапазоне
+# Без фильтра по названию берём готовые числа из таблицы price_facets;
+# с фильтром считаем по покрывающему индексу (название, цена) только строки с нужным началом названия
+def query_facet_counts(prefix):
+    if not prefix:
+        counts = {row.bucket: row.product_count for row in PriceFacet.query.all()}
+    else:
+        bucket_expr = price_bucket_expr()
+        counts = dict(db.session.query(bucket_expr, func.count())
+                      .filter(prefix_filter(Product.name, prefix))
+                      .group_by(bucket_expr).all())
+    return [{'bucket': n, 'label': bucket_label(n), 'count': counts.get(n, 0)}
+            for n in range(len(PRICE_BUCKETS))]
+
+# Чтение через кэш: ключ включает версию каталога, поэтому после добавления товара
+# старые страницы и счётчики больше не используются и вытесняются из LRU
+def cached(key, loader):
+    key = f'catalog:v{catalog_version}:{key}'
+    value = catalog_cache.get(key)
+    if value is None:
+        value = loader()
+        catalog_cache.set(key, value)
+    return value
+
+# Главная страница: каталог товаров с сортировкой, фильтрами и постраничным выводом
 @app.route('/')
 def index():
-    # Получаем все товары из базы данных
-    products = Product.query.all()
-    # Передаём список товаров в шаблон
-    return render_template('index.html', products=products)
+    sort = request.args.get('sort', 'new')
+    if sort not in CATALOG_SORTS:
+        sort = 'new'
+    bucket = request.args.get('bucket', type=int)
+    if bucket is not None and not 0 <= bucket < len(PRICE_BUCKETS):
+        bucket = None
+    prefix = request.args.get('prefix', '').strip()
+    after_id = request.args.get('after_id', type=int)
+    # Тип значения курсора зависит от столбца сортировки
+    after_key = request.args.get('after', type=float if sort.startswith('price') else str)
+    products = cached(f'page:{sort}:{bucket}:{prefix}:{after_key}:{after_id}',
+                      lambda: query_product_page(sort, bucket, prefix, after_key, after_id))
+    facets = cached(f'facets:{prefix}', lambda: query_facet_counts(prefix))
+    # Курсор следующей страницы строится по последнему товару текущей
+    next_page = None
+    if len(products) > PRODUCTS_PER_PAGE:
+        products = products[:PRODUCTS_PER_PAGE]
+        last = products[-1]
+        column, _ = CATALOG_SORTS[sort]
+        next_page = {'after_id': last['id']}
+        if column is not None:
+            next_page['after'] = last[column.key]
+    # Передаём страницу товаров и счётчики фильтров в шаблон
+    return render_template('index.html', products=products, facets=facets, sort=sort,
+                           bucket=bucket, prefix=prefix, next_page=next_page)
 
 # Страница товара: подробная информация о товаре
 @app.route('/product/<int:product_id>')
 def product_detail(product_id):
-    # Получаем товар по id или возвращаем 404
-    product = Product.query.get_or_404(product_id)
+    # Получаем товар по id (из кэша или из базы данных) или возвращаем 404
+    product = get_product(product_id)
+    if product is None:
+        abort(404)
     return render_template('product.html', product=product)
 
+# Статистика кэша каталога: размер, попадания и промахи
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(catalog_cache.stats())
+
+# Превращаем пользовательский ввод в запрос FTS5
+# Каждое слово берётся в кавычки, чтобы символы вроде " * - : не ломали синтаксис запроса
+# prefix=True — последнее слово ищется как начало слова (для подсказок при вводе)
+def build_match_query(q, prefix=False):
+    words = re.findall(r'\w+', q)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if prefix:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+# Поиск товаров по индексу FTS5 с ранжированием BM25
+# Совпадение в названии весит в 10 раз больше, чем совпадение в описании
+def search_products(match, limit, offset=0):
+    rows = db.session.execute(text(
+        'SELECT p.id, p.name, p.price, bm25(products_fts, 10.0, 1.0) AS rank '
+        'FROM products_fts JOIN products p ON p.id = products_fts.rowid '
+        'WHERE products_fts MATCH :match '
+        'ORDER BY rank LIMIT :limit OFFSET :offset'
+    ), {'match': match, 'limit': limit, 'offset': offset})
+    return [{'id': row.id, 'name': row.name, 'price': row.price} for row in rows]
+
+# Поиск товаров: HTML-страница или JSON (?format=json)
+# ?prefix=1 включает режим подсказок: поиск по началу последнего слова
+@app.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    prefix = request.args.get('prefix') == '1'
+    page = max(request.args.get('page', 1, type=int), 1)
+    # В режиме подсказок возвращаем только первые несколько результатов
+    per_page = TYPEAHEAD_LIMIT if prefix else SEARCH_PER_PAGE
+    match = build_match_query(q, prefix)
+    results = []
+    if match:
+        # Берём на один результат больше, чтобы понять, есть ли следующая страница
+        results = search_products(match, per_page + 1, (page - 1) * per_page)
+    has_next = len(results) > per_page
+    results = results[:per_page]
+    if request.args.get('format') == 'json':
+        return jsonify(query=q, page=page, has_next=has_next, results=results)
+    return render_template('search.html', q=q, page=page, has_next=has_next, results=results)
+
+# Команда для существующих баз данных: создаёт индекс и заполняет его заново
+# Заодно создаёт индекс по products.name для подсказок по префиксу (/api/products)
+# Запуск: flask --app app rebuild-search-index
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    for statement in PRODUCTS_FTS_DDL:
+        db.session.execute(text(statement))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_products_name ON products (name)'))
+    # Специальная команда FTS5 'rebuild' перечитывает всю таблицу products
+    db.session.execute(text("INSERT INTO products_fts(products_fts) VALUES('rebuild')"))
+    db.session.commit()
+    print('Поисковый индекс перестроен')
+
 # Страница добавления нового товара
 @app.route('/add_product', methods=['GET', 'POST'])
 def add_product():
@@ -97,6 +464,7 @@ def add_product():
         name = request.form.get('name')
         description = request.form.get('description')
         price = request.form.get('price')
+        stock = request.form.get('stock', 0)
         # Проверяем, что обязательные поля заполнены
         if not name or not price:
             flash('Название и цена обязательны!')
@@ -106,9 +474,21 @@ def add_product():
         except ValueError:
             flash('Цена должна быть числом!')
             return redirect(url_for('add_product'))
-        product = Product(name=name, description=description, price=price)
+        try:
+            stock = int(stock)
+        except ValueError:
+            stock = -1
+        if stock < 0:
+            flash('Остаток должен быть целым неотрицательным числом!')
+            return redirect(url_for('add_product'))
+        product = Product(name=name, description=description, price=price, stock=stock)
         db.session.add(product)
+        # Увеличиваем счётчик ценового диапазона в той же транзакции
+        upsert_totals(PriceFacet, 'bucket', [{'bucket': price_bucket(price), 'product_count': 1}])
         db.session.commit()
+        # Новый товар должен появиться в каталоге: сбрасываем закэшированные страницы
+        global catalog_version
+        catalog_version += 1
         flash('Товар добавлен!')
         return redirect(url_for('index'))
     return render_template('add_product.html')
@@ -131,43 +511,438 @@ def register():
         return redirect(url_for('index'))
     return render_template('register.html')
 
+# Разбираем строки формы заказа: пары полей product_id и quantity в порядке строк
+# Строка разбирается целиком: строка без товара пропускается вместе со своим количеством,
+# чтобы количества не сдвигались на чужие товары; нечисловой id товара — ошибка (ValueError)
+def parse_order_rows(product_ids, quantities):
+    items = []
+    for product_id, quantity in zip_longest(product_ids, quantities):
+        if product_id is None or not product_id.strip():
+            continue
+        items.append((int(product_id), parse_quantity(quantity)))
+    return items
+
+# Приводим количество товара к целому числу не меньше 1
+def parse_quantity(value):
+    try:
+        qty = int(value)
+    except (TypeError, ValueError):
+        qty = 1
+    return max(qty, 1)
+
+# Исключение: товара на складе меньше, чем заказано
+class OutOfStockError(Exception):
+    def __init__(self, product_id):
+        super().__init__(f'Недостаточно товара на складе (товар №{product_id})')
+        self.product_id = product_id
+
+# Резервируем товар на складе условным атомарным UPDATE:
+# UPDATE products SET stock = stock - :qty WHERE id = :id AND stock >= :qty
+# Проверка и списание выполняются базой данных одной командой, поэтому
+# параллельные заказы не могут «перезаписать» остаток друг друга
+# Возвращает словарь {product_id: цена} — цены читаются той же командой (RETURNING)
+def reserve_stock(items):
+    # Суммируем количество по каждому товару, чтобы списать его одним запросом
+    totals = {}
+    for pid, qty in items:
+        totals[pid] = totals.get(pid, 0) + qty
+    prices = {}
+    for pid, qty in totals.items():
+        price = db.session.execute(
+            update(Product)
+            .where(Product.id == pid, Product.stock >= qty)
+            .values(stock=Product.stock - qty)
+            .returning(Product.price)
+        ).scalar_one_or_none()
+        # Ни одна строка не изменилась — товара нет или остатка не хватает
+        if price is None:
+            raise OutOfStockError(pid)
+        prices[pid] = price
+    return prices
+
+# Прибавляем значения к сводной таблице одним INSERT ... ON CONFLICT DO UPDATE на все строки
+# key — первичный ключ сводной таблицы, остальные столбцы строк суммируются
+def upsert_totals(model, key, rows):
+    if not rows:
+        return
+    table = model.__table__
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={col: table.c[col] + stmt.excluded[col] for col in rows[0] if col != key},
+    )
+    db.session.execute(stmt, rows)
+
+# Обновляем сводные таблицы продаж для только что созданных заказов
+# entries — список пар (заказ, [(product_id, quantity), ...]), prices — цены товаров
+def record_sales(entries, prices):
+    by_product, by_user, by_day = {}, {}, {}
+    for order, items in entries:
+        for pid, qty in items:
+            row = by_product.setdefault(pid, {'product_id': pid, 'units': 0, 'revenue': 0.0})
+            row['units'] += qty
+            row['revenue'] += qty * prices[pid]
+        row = by_user.setdefault(order.user_id, {'user_id': order.user_id, 'orders_count': 0, 'spend': 0.0})
+        row['orders_count'] += 1
+        row['spend'] += order.total
+        day = order.created_at.date()
+        row = by_day.setdefault(day, {'day': day, 'orders_count': 0, 'units': 0, 'revenue': 0.0})
+        row['orders_count'] += 1
+        row['units'] += order.item_count
+        row['revenue'] += order.total
+    upsert_totals(ProductSales, 'product_id', list(by_product.values()))
+    upsert_totals(UserSales, 'user_id', list(by_user.values()))
+    upsert_totals(DailySales, 'day', list(by_day.values()))
+
+# Новый объект заказа с итогами, посчитанными по ценам на момент оформления
+def build_order(user_id, items, prices, created_at):
+    return Order(
+        user_id=user_id,
+        created_at=created_at,
+        total=sum(qty * prices[pid] for pid, qty in items),
+        item_count=sum(qty for _, qty in items),
+    )
+
+# Создаём заказ вместе со всеми позициями в текущей транзакции
+# items — список пар (product_id, quantity)
+# Функция не делает commit: вызывающий код фиксирует транзакцию один раз
+def create_order(user_id, items):
+    # Списание остатков идёт первой командой транзакции: SQLite сразу берёт
+    # блокировку записи, и параллельные заказы просто ждут её в очереди (timeout)
+    prices = reserve_stock(items)
+    order = build_order(user_id, items, prices, datetime.utcnow())
+    db.session.add(order)
+    # flush отправляет INSERT заказа без фиксации транзакции, чтобы получить order.id
+    db.session.flush()
+    # Все позиции заказа вставляются одним пакетным запросом (executemany)
+    db.session.execute(insert(OrderItem), [
+        {'order_id': order.id, 'product_id': pid, 'quantity': qty, 'price': prices[pid]}
+        for pid, qty in items
+    ])
+    record_sales([(order, items)], prices)
+    return order
+
+# Условие «строка начинается с prefix» в виде диапазона column >= prefix AND column < prefix + '\uffff'
+# В отличие от LIKE 'prefix%' такой диапазон всегда использует обычный индекс по столбцу
+# Сравнение регистрозависимое, как и сам индекс
+def prefix_filter(column, prefix):
+    return column.between(prefix, prefix + '\uffff')
+
+# Читаем параметры подсказок: начало строки и ограничение количества результатов
+def typeahead_args():
+    prefix = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', TYPEAHEAD_LIMIT, type=int), 1), TYPEAHEAD_MAX_LIMIT)
+    return prefix, limit
+
+# Подсказки пользователей по началу имени для формы заказа
+@app.route('/api/users')
+def users_typeahead():
+    prefix, limit = typeahead_args()
+    if not prefix:
+        return jsonify(results=[])
+    users = (db.session.query(User.id, User.username)
+             .filter(prefix_filter(User.username, prefix))
+             .order_by(User.username).limit(limit).all())
+    return jsonify(results=[{'id': u.id, 'username': u.username} for u in users])
+
+# Подсказки товаров по началу названия для формы заказа
+@app.route('/api/products')
+def products_typeahead():
+    prefix, limit = typeahead_args()
+    if not prefix:
+        return jsonify(results=[])
+    products = (db.session.query(Product.id, Product.name, Product.price, Product.stock)
+                .filter(prefix_filter(Product.name, prefix))
+                .order_by(Product.name).limit(limit).all())
+    return jsonify(results=[{'id': p.id, 'name': p.name, 'price': p.price, 'stock': p.stock}
+                            for p in products])
+
 # Страница оформления заказа
+# Форма не загружает списки пользователей и товаров целиком: они подбираются через /api/users и /api/products
 @app.route('/order', methods=['GET', 'POST'])
 def order():
-    # Получаем всех пользователей и товары для выбора
-    users = User.query.all()
-    products = Product.query.all()
     if request.method == 'POST':
-        user_id = request.form.get('user_id')
-        product_ids = request.form.getlist('product_id')
-        quantities = request.form.getlist('quantity')
-        if not user_id or not product_ids:
+        user_id = request.form.get('user_id', type=int)
+        username = request.form.get('username', '').strip()
+        # Если id не передан, ищем пользователя по имени (поиск по уникальному индексу)
+        if not user_id and username:
+            user_id = db.session.query(User.id).filter_by(username=username).scalar()
+        try:
+            items = parse_order_rows(request.form.getlist('product_id'), request.form.getlist('quantity'))
+        except ValueError:
+            flash('Некорректный товар в заказе!')
+            return redirect(url_for('order'))
+        if not user_id or not items:
             flash('Выберите пользователя и хотя бы один товар!')
             return redirect(url_for('order'))
-        order = Order(user_id=int(user_id))
-        db.session.add(order)
-        db.session.commit()
-        # Добавляем товары в заказ
-        for pid, qty in zip(product_ids, quantities):
-            try:
-                qty = int(qty)
-            except ValueError:
-                qty = 1
-            if qty < 1:
-                qty = 1
-            order_item = OrderItem(order_id=order.id, product_id=int(pid), quantity=qty)
-            db.session.add(order_item)
-        db.session.commit()
+        # Заказ и его позиции сохраняются в одной транзакции:
+        # при ошибке не остаётся «половинчатого» заказа без товаров
+        try:
+            create_order(user_id, items)
+            db.session.commit()
+            # Остатки заказанных товаров изменились
+            invalidate_products(pid for pid, _ in items)
+        except OutOfStockError as e:
+            db.session.rollback()
+            flash(str(e))
+            return redirect(url_for('order'))
+        except Exception:
+            db.session.rollback()
+            raise
         flash('Заказ оформлен!')
         return redirect(url_for('index'))
-    return render_template('order.html', users=users, products=products)
+    return render_template('order.html')
+
+# Разбираем тело запроса массового импорта в список заказов
+# Поддерживаются JSON-массив (или объект с ключом "orders") и JSONL — один заказ в строке
+def parse_import_body():
+    body = request.get_data(as_text=True)
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    data = json.loads(body)
+    if isinstance(data, dict):
+        data = data.get('orders')
+    if not isinstance(data, list):
+        raise ValueError('ожидается список заказов')
+    return data
+
+# Массовый импорт заказов: все заказы запроса сохраняются одной транзакцией
+# Формат заказа: {"user_id": 1, "items": [{"product_id": 2, "quantity": 3}, ...]}
+@app.route('/orders/import', methods=['POST'])
+def import_orders():
+    try:
+        raw_orders = parse_import_body()
+    except ValueError as e:
+        # json.JSONDecodeError — подкласс ValueError
+        return jsonify(error=f'Некорректный JSON: {e}'), 400
+    if not raw_orders:
+        return jsonify(error='Список заказов пуст'), 400
+    if len(raw_orders) > MAX_IMPORT_ORDERS:
+        return jsonify(error=f'Не более {MAX_IMPORT_ORDERS} заказов за один запрос'), 400
+    # Проверяем структуру всех заказов до обращения к базе данных
+    parsed = []
+    for n, raw in enumerate(raw_orders, start=1):
+        try:
+            user_id = int(raw['user_id'])
+            items = [(int(item['product_id']), parse_quantity(item.get('quantity', 1)))
+                     for item in raw['items']]
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return jsonify(error=f'Заказ №{n}: нужны user_id и items с product_id'), 400
+        if not items:
+            return jsonify(error=f'Заказ №{n}: нет ни одного товара'), 400
+        parsed.append((user_id, items))
+    # Проверяем существование пользователей и товаров двумя запросами на весь пакет
+    user_ids = {user_id for user_id, _ in parsed}
+    product_ids = {pid for _, items in parsed for pid, _ in items}
+    known_users = {row.id for row in db.session.query(User.id).filter(User.id.in_(user_ids))}
+    known_products = {row.id for row in db.session.query(Product.id).filter(Product.id.in_(product_ids))}
+    if user_ids - known_users:
+        return jsonify(error=f'Неизвестные пользователи: {sorted(user_ids - known_users)}'), 400
+    if product_ids - known_products:
+        return jsonify(error=f'Неизвестные товары: {sorted(product_ids - known_products)}'), 400
+    # Заказы вставляются пачкой (один flush), позиции — одним executemany на весь пакет
+    try:
+        # Резервируем остатки сразу для всего пакета
+        prices = reserve_stock([item for _, items in parsed for item in items])
+        now = datetime.utcnow()
+        orders = [build_order(user_id, items, prices, now) for user_id, items in parsed]
+        db.session.add_all(orders)
+        db.session.flush()
+        db.session.execute(insert(OrderItem), [
+            {'order_id': order.id, 'product_id': pid, 'quantity': qty, 'price': prices[pid]}
+            for order, (_, items) in zip(orders, parsed)
+            for pid, qty in items
+        ])
+        record_sales([(order, items) for order, (_, items) in zip(orders, parsed)], prices)
+        db.session.commit()
+        invalidate_products(product_ids)
+    except OutOfStockError as e:
+        db.session.rollback()
+        return jsonify(error=str(e), product_id=e.product_id), 409
+    except Exception:
+        db.session.rollback()
+        raise
+    return jsonify(imported=len(orders), order_ids=[order.id for order in orders]), 201
+
+# Команда пересчёта счётчиков ценовых диапазонов по всем товарам
+# В базе, созданной до появления фильтра по цене, сначала создаёт индексы по цене
+# Запуск: flask --app app rebuild-price-facets
+@app.cli.command('rebuild-price-facets')
+def rebuild_price_facets():
+    db.create_all()
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_products_price ON products (price)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_products_name_price ON products (name, price)'))
+    bucket_expr = price_bucket_expr()
+    counts = db.session.query(bucket_expr, func.count()).group_by(bucket_expr).all()
+    db.session.execute(PriceFacet.__table__.delete())
+    if counts:
+        db.session.execute(insert(PriceFacet), [{'bucket': n, 'product_count': c} for n, c in counts])
+    db.session.commit()
+    print('Счётчики ценовых диапазонов пересчитаны')
+
+# Отчёт о продажах: топ товаров по выручке, топ покупателей и итоги по дням
+# Данные читаются из сводных таблиц, поэтому стоимость запроса зависит от размера отчёта,
+# а не от общего количества заказов
+@app.route('/reports/sales')
+def sales_report():
+    limit = min(max(request.args.get('limit', REPORT_LIMIT, type=int), 1), 100)
+    days = min(max(request.args.get('days', REPORT_DAYS, type=int), 1), 366)
+    top_products = (ProductSales.query.options(joinedload(ProductSales.product))
+                    .order_by(ProductSales.revenue.desc()).limit(limit).all())
+    top_users = (UserSales.query.options(joinedload(UserSales.user))
+                 .order_by(UserSales.spend.desc()).limit(limit).all())
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    daily = DailySales.query.filter(DailySales.day >= since).order_by(DailySales.day.desc()).all()
+    if request.args.get('format') == 'json':
+        return jsonify(
+            products=[{'product_id': row.product_id, 'name': row.product.name,
+                       'units': row.units, 'revenue': row.revenue} for row in top_products],
+            users=[{'user_id': row.user_id, 'username': row.user.username,
+                    'orders': row.orders_count, 'spend': row.spend} for row in top_users],
+            daily=[{'day': row.day.isoformat(), 'orders': row.orders_count,
+                    'units': row.units, 'revenue': row.revenue} for row in daily],
+        )
+    return render_template('sales_report.html', top_products=top_products,
+                           top_users=top_users, daily=daily, days=days)
+
+# Добавляем в существующую таблицу недостающие столбцы: db.create_all() создаёт только новые таблицы
+# columns — имя столбца → его определение в ALTER TABLE ... ADD COLUMN; возвращает добавленные имена
+def add_missing_columns(table, columns):
+    existing = {row[1] for row in db.session.execute(text(f'PRAGMA table_info({table})'))}
+    added = [name for name in columns if name not in existing]
+    for name in added:
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {columns[name]}'))
+    return added
+
+# Столбцы сводок продаж в базах, созданных до их появления: цена позиции остаётся пустой
+# (для неё используется текущая цена товара), а старые заказы получают время миграции —
+# настоящее время их оформления не сохранилось. SQLite не добавляет столбец NOT NULL без
+# постоянного значения по умолчанию, поэтому created_at заполняется отдельной командой
+def migrate_sales_columns():
+    add_missing_columns('order_items', {'price': 'FLOAT'})
+    if add_missing_columns('orders', {'created_at': 'DATETIME'}):
+        db.session.execute(text(
+            "UPDATE orders SET created_at = strftime('%Y-%m-%d %H:%M:%f000', 'now') WHERE created_at IS NULL"
+        ))
+
+# Команда пересчёта сводных таблиц продаж с нуля по всем заказам
+# В базе, созданной до появления сводок, сначала добавляет недостающие столбцы заказов
+# Для позиций без сохранённой цены используется текущая цена товара
+# Запуск: flask --app app rebuild-sales-summary
+@app.cli.command('rebuild-sales-summary')
+def rebuild_sales_summary():
+    db.create_all()
+    migrate_sales_columns()
+    for model in (ProductSales, UserSales, DailySales):
+        db.session.execute(model.__table__.delete())
+    db.session.execute(text(
+        'INSERT INTO product_sales (product_id, units, revenue) '
+        'SELECT oi.product_id, SUM(oi.quantity), SUM(oi.quantity * COALESCE(oi.price, p.price)) '
+        'FROM order_items oi JOIN products p ON p.id = oi.product_id '
+        'GROUP BY oi.product_id'
+    ))
+    db.session.execute(text(
+        'INSERT INTO user_sales (user_id, orders_count, spend) '
+        'SELECT o.user_id, COUNT(DISTINCT o.id), COALESCE(SUM(oi.quantity * COALESCE(oi.price, p.price)), 0) '
+        'FROM orders o LEFT JOIN order_items oi ON oi.order_id = o.id '
+        'LEFT JOIN products p ON p.id = oi.product_id '
+        'GROUP BY o.user_id'
+    ))
+    db.session.execute(text(
+        'INSERT INTO daily_sales (day, orders_count, units, revenue) '
+        'SELECT date(o.created_at), COUNT(DISTINCT o.id), COALESCE(SUM(oi.quantity), 0), '
+        'COALESCE(SUM(oi.quantity * COALESCE(oi.price, p.price)), 0) '
+        'FROM orders o LEFT JOIN order_items oi ON oi.order_id = o.id '
+        'LEFT JOIN products p ON p.id = oi.product_id '
+        'GROUP BY date(o.created_at)'
+    ))
+    db.session.commit()
+    print('Сводные таблицы продаж пересчитаны')
 
 # Страница просмотра всех заказов
 @app.route('/orders')
 def orders():
-    # Получаем все заказы из базы данных
-    orders = Order.query.all()
-    return render_template('orders.html', orders=orders)
+    # before — id заказа, после которого продолжается список (keyset-пагинация)
+    before = request.args.get('before', type=int)
+    # user_id — необязательный фильтр по покупателю
+    user_id = request.args.get('user_id', type=int)
+    # Пользователя загружаем JOIN-ом, а позиции и их товары — отдельными
+    # запросами SELECT ... WHERE id IN (...), поэтому число запросов
+    # не зависит от количества заказов на странице
+    query = Order.query.options(
+        joinedload(Order.user),
+        selectinload(Order.order_items).joinedload(OrderItem.product),
+    )
+    if user_id:
+        query = query.filter(Order.user_id == user_id)
+    if before:
+        query = query.filter(Order.id < before)
+    # Берём на один заказ больше, чтобы понять, есть ли следующая страница
+    orders = query.order_by(Order.id.desc()).limit(ORDERS_PER_PAGE + 1).all()
+    next_before = None
+    if len(orders) > ORDERS_PER_PAGE:
+        orders = orders[:ORDERS_PER_PAGE]
+        next_before = orders[-1].id
+    return render_template('orders.html', orders=orders, user_id=user_id, next_before=next_before)
+
+# История заказов пользователя: только строки заказа (сумма и количество уже посчитаны),
+# выбираются диапазоном по индексу (user_id, id) с keyset-пагинацией
+@app.route('/user/<int:user_id>/orders')
+def user_orders(user_id):
+    user = db.session.get(User, user_id)
+    if user is None:
+        abort(404)
+    before = request.args.get('before', type=int)
+    query = (db.session.query(Order.id, Order.created_at, Order.total, Order.item_count)
+             .filter(Order.user_id == user_id))
+    if before:
+        query = query.filter(Order.id < before)
+    orders = query.order_by(Order.id.desc()).limit(ORDERS_PER_PAGE + 1).all()
+    next_before = None
+    if len(orders) > ORDERS_PER_PAGE:
+        orders = orders[:ORDERS_PER_PAGE]
+        next_before = orders[-1].id
+    return render_template('user_orders.html', user=user, orders=orders, next_before=next_before)
+
+# Команда заполнения total и item_count у заказов, оформленных до появления этих столбцов
+# В базе, созданной до их появления, сначала добавляет столбцы заказов и индексы (user_id, id)
+# и order_items.order_id, по которому пересчитываются суммы
+# Для позиций без сохранённой цены используется текущая цена товара
+# Запуск: flask --app app rebuild-order-totals
+@app.cli.command('rebuild-order-totals')
+def rebuild_order_totals():
+    db.create_all()
+    migrate_sales_columns()
+    add_missing_columns('orders', {'total': 'FLOAT NOT NULL DEFAULT 0',
+                                   'item_count': 'INTEGER NOT NULL DEFAULT 0'})
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_orders_user_id_id ON orders (user_id, id)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items (order_id)'))
+    db.session.execute(text(
+        'UPDATE orders SET '
+        'total = (SELECT COALESCE(SUM(oi.quantity * COALESCE(oi.price, p.price)), 0) '
+        '         FROM order_items oi JOIN products p ON p.id = oi.product_id WHERE oi.order_id = orders.id), '
+        'item_count = (SELECT COALESCE(SUM(oi.quantity), 0) FROM order_items oi WHERE oi.order_id = orders.id)'
+    ))
+    db.session.commit()
+    print('Суммы заказов пересчитаны')
+
+# Команда добавления остатков товаров в базу, созданную до их появления
+# Остаток существующих товаров неизвестен, поэтому начальное значение задаётся явно:
+# при 0 ни один существующий товар нельзя будет заказать, пока остаток не внесут вручную
+# Если столбец stock уже есть, остатки не меняются — повторный запуск не затирает учёт
+# Запуск: flask --app app migrate-stock --initial-stock 100
+@app.cli.command('migrate-stock')
+@click.option('--initial-stock', type=click.IntRange(min=0), required=True,
+              help='Начальный остаток каждого существующего товара')
+def migrate_stock(initial_stock):
+    added = add_missing_columns('products', {
+        'stock': 'INTEGER NOT NULL DEFAULT 0 CONSTRAINT ck_products_stock_non_negative CHECK (stock >= 0)'})
+    if not added:
+        print('Столбец stock уже есть, остатки не изменены')
+        return
+    result = db.session.execute(text('UPDATE products SET stock = :stock'), {'stock': initial_stock})
+    db.session.commit()
+    print(f'Остаток {initial_stock} установлен для товаров: {result.rowcount}')
 
 # Запуск приложения только если файл запущен напрямую
 if __name__ == '__main__':
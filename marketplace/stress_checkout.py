@@ -0,0 +1,91 @@
+# Стресс-тест оформления заказов: много потоков одновременно покупают один «горячий» товар
+# Проверяет, что остаток не уходит в минус и что списано ровно столько, сколько продано,
+# и выводит пропускную способность (заказов в секунду)
+#
+# Запуск из каталога marketplace:
+#     python stress_checkout.py --threads 16 --attempts 200 --stock 1000
+# Тест работает с временной базой данных и не трогает marketplace.db
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Разбираем аргументы командной строки
+parser = argparse.ArgumentParser(description='Стресс-тест резервирования остатков')
+parser.add_argument('--threads', type=int, default=16, help='число параллельных покупателей')
+parser.add_argument('--attempts', type=int, default=200, help='попыток заказа на один поток')
+parser.add_argument('--stock', type=int, default=1000, help='начальный остаток товара')
+parser.add_argument('--quantity', type=int, default=3, help='количество товара в одном заказе')
+args = parser.parse_args()
+
+# Подключаем приложение к временной базе до его импорта
+db_dir = tempfile.mkdtemp()
+os.environ['MARKETPLACE_DATABASE_URI'] = 'sqlite:///' + os.path.join(db_dir, 'stress.db')
+
+from app import app, db, User, Product, OrderItem
+
+with app.app_context():
+    db.create_all()
+    user = User(username='stress')
+    product = Product(name='Горячий товар', price=1.0, stock=args.stock)
+    db.session.add_all([user, product])
+    db.session.commit()
+    user_id, product_id = user.id, product.id
+
+# Счётчики успешных и отклонённых заказов (общие для всех потоков)
+lock = threading.Lock()
+results = {'ok': 0, 'rejected': 0, 'errors': 0}
+
+def buyer():
+    # У каждого потока свой тестовый клиент
+    client = app.test_client()
+    for _ in range(args.attempts):
+        response = client.post('/order', data={
+            'user_id': str(user_id),
+            'product_id': [str(product_id)],
+            'quantity': [str(args.quantity)],
+        })
+        # Успешный заказ перенаправляет на главную, отказ — обратно на форму заказа
+        if response.status_code != 302:
+            key = 'errors'
+        elif response.headers['Location'].endswith('/order'):
+            key = 'rejected'
+        else:
+            key = 'ok'
+        with lock:
+            results[key] += 1
+
+threads = [threading.Thread(target=buyer) for _ in range(args.threads)]
+started = time.perf_counter()
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+elapsed = time.perf_counter() - started
+
+with app.app_context():
+    stock_left = db.session.get(Product, product_id).stock
+    sold = db.session.query(db.func.coalesce(db.func.sum(OrderItem.quantity), 0)).scalar()
+
+total = args.threads * args.attempts
+print(f'Попыток заказа: {total}, успешно: {results["ok"]}, отказов: {results["rejected"]}, ошибок: {results["errors"]}')
+print(f'Продано: {sold} шт., остаток: {stock_left} шт. из {args.stock}')
+print(f'Время: {elapsed:.2f} с, пропускная способность: {total / elapsed:.0f} попыток/с, '
+      f'{results["ok"] / elapsed:.0f} заказов/с')
+
+# Проверки: нет перепродажи, нет потерянных обновлений, нет ошибок блокировки
+failures = []
+if stock_left < 0:
+    failures.append('остаток ушёл в минус')
+if sold != results['ok'] * args.quantity:
+    failures.append('количество проданного не совпадает с числом успешных заказов')
+if sold + stock_left != args.stock:
+    failures.append('потерянное обновление: продано + остаток != начальный остаток')
+if results['errors']:
+    failures.append('часть запросов завершилась ошибкой')
+if failures:
+    print('ПРОВАЛ: ' + '; '.join(failures))
+    sys.exit(1)
+print('OK: перепродажи нет')
@@ -1,26 +1,75 @@
 # Импортируем необходимые модули из стандартной библиотеки Python и Flask
 # Flask — основной класс для создания приложения
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
 # Flask-SQLAlchemy — расширение для интеграции SQLAlchemy с Flask
 # Документация: https://flask-sqlalchemy.palletsprojects.com/
 from flask_sqlalchemy import SQLAlchemy
+# text и tuple_ — «сырой» SQL и сравнение пар значений (курсор keyset-пагинации)
+from sqlalchemy import text, tuple_, update, case, insert
+# insert диалекта SQLite поддерживает INSERT ... ON CONFLICT DO NOTHING
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 # datetime — модуль для работы с датой и временем
-from datetime import datetime
+from datetime import datetime, timedelta
+# json, zlib и namedtuple — архив старых сообщений: сжатые JSON-блоки и сообщения, прочитанные из них
+import json
+import zlib
+from collections import namedtuple
+# click — библиотека, на которой построен Flask CLI (параметры команд)
+import click
+
+# os и sys — модули стандартной библиотеки для работы с путями и путём поиска модулей
+import os
+import sys
+# Добавляем корень репозитория в путь поиска модулей, чтобы подключить общий модуль common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# configure_sqlite — общие настройки SQLite (WAL, PRAGMA, пул соединений), см. common/sqlite_engine.py
+from common.sqlite_engine import configure_sqlite
+# Broker — брокер событий в памяти процесса для доставки новых сообщений, см. common/pubsub.py
+from common.pubsub import Broker
+# LRUCache — ограниченный по размеру кэш с временем жизни записей, см. common/lru_cache.py
+from common.lru_cache import LRUCache
 
 # Создаём экземпляр Flask-приложения
 app = Flask(__name__)
 # Устанавливаем секретный ключ, необходимый для работы flash-сообщений и защиты от CSRF-атак
 app.config['SECRET_KEY'] = 'очень_секретный_ключ'
-# Указываем строку подключения к базе данных SQLite
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///messanger.db'
+# Указываем строку подключения к базе данных SQLite (переменная окружения MESSANGER_DATABASE_URI
+# позволяет подключить другую базу, например временную в бенчмарке)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('MESSANGER_DATABASE_URI', 'sqlite:///messanger.db')
 # Отключаем отслеживание изменений объектов для экономии памяти
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Количество сообщений на одной странице диалога
+MESSAGES_PER_PAGE = 50
+# Количество пользователей на главной странице и диалогов на странице входящих
+USERS_PER_PAGE = 50
+CONVERSATIONS_PER_PAGE = 30
+# Сколько символов последнего сообщения показывать во входящих
+PREVIEW_LENGTH = 80
+# Long-poll доставка новых сообщений: сколько секунд запрос ждёт новое сообщение,
+# прежде чем вернуть пустой ответ (клиент сразу переподключается)
+POLL_TIMEOUT = 25
+# Архив: сообщения старше ARCHIVE_AFTER_DAYS дней переносятся в сжатые блоки
+# по ARCHIVE_BLOCK_SIZE сообщений; распакованные блоки кэшируются для листания назад
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BLOCK_SIZE = 500
+ARCHIVE_CACHE_SIZE = 256
+# Рассылка: получатели обрабатываются порциями по BROADCAST_CHUNK_SIZE, каждая порция — одна транзакция
+BROADCAST_CHUNK_SIZE = 2000
+
+# Включаем общие настройки SQLite до создания движка базы данных
+configure_sqlite(app)
 
 # Создаём экземпляр SQLAlchemy для работы с базой данных
 # db — объект для взаимодействия с БД
 # Документация: https://flask-sqlalchemy.palletsprojects.com/en/latest/api/
 db = SQLAlchemy(app)
 
+# Брокер новых сообщений: канал conversation:<user_low_id>-<user_high_id> на каждый диалог
+# (по паре пользователей, поэтому ждать можно и диалог, которого ещё нет в базе)
+message_events = Broker()
+# Кэш распакованных блоков архива: id блока → список сообщений (блоки не меняются)
+archive_cache = LRUCache(maxsize=ARCHIVE_CACHE_SIZE, ttl=60 * 60)
+
 # Определяем модель пользователя (User)
 class User(db.Model):
     # Имя таблицы в базе данных
@@ -37,11 +86,52 @@ class User(db.Model):
     def __repr__(self):
         return f'<User {self.id} {self.username}>'
 
+# Определяем модель диалога (Conversation)
+# Диалог — упорядоченная пара пользователей: user_low_id <= user_high_id,
+# поэтому переписка A → B и B → A относится к одному диалогу
+class Conversation(db.Model):
+    __tablename__ = 'conversations'
+    id = db.Column(db.Integer, primary_key=True)
+    user_low_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_high_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # last_message_id — указатель на последнее сообщение диалога, обновляется при отправке
+    last_message_id = db.Column(db.Integer, db.ForeignKey('messages.id', use_alter=True))
+
+    # Уникальный индекс по паре: диалог находится одним поиском по индексу
+    __table_args__ = (db.UniqueConstraint('user_low_id', 'user_high_id', name='uq_conversations_users'),)
+
+    def __repr__(self):
+        return f'<Conversation {self.id} {self.user_low_id}-{self.user_high_id}>'
+
+# Участник диалога: по строке на каждого пользователя диалога
+# Входящие пользователя — диапазон индекса (user_id, last_message_at, conversation_id)
+# от самого свежего диалога, без просмотра сообщений
+class ConversationMember(db.Model):
+    __tablename__ = 'conversation_members'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), primary_key=True)
+    # peer_id — собеседник (для диалога с самим собой совпадает с user_id)
+    peer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # last_message_at — время последнего сообщения диалога, обновляется при отправке
+    last_message_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # unread_count — сколько сообщений собеседника пользователь ещё не видел
+    # last_read_message_id — последнее сообщение диалога на момент последнего просмотра
+    # Оба поля меняются в той же транзакции, что и отправка сообщения или открытие диалога
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_read_message_id = db.Column(db.Integer, db.ForeignKey('messages.id', use_alter=True))
+
+    # Частичный покрывающий индекс по диалогам с непрочитанными сообщениями: /unread читает только его
+    __table_args__ = (db.Index('ix_conversation_members_inbox', 'user_id', 'last_message_at', 'conversation_id'),
+                      db.Index('ix_conversation_members_unread', 'user_id', 'conversation_id', 'peer_id',
+                               'unread_count', 'last_read_message_id', sqlite_where=text('unread_count > 0')))
+
 # Определяем модель сообщения (Message)
 class Message(db.Model):
     __tablename__ = 'messages'
     # id — первичный ключ, уникальный идентификатор сообщения
     id = db.Column(db.Integer, primary_key=True)
+    # conversation_id — внешний ключ на диалог
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
     # sender_id — внешний ключ на пользователя-отправителя
     sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     # recipient_id — внешний ключ на пользователя-получателя
@@ -49,18 +139,350 @@ class Message(db.Model):
     # content — содержимое сообщения, не может быть пустым
     content = db.Column(db.Text, nullable=False)
     # timestamp — дата и время отправки сообщения
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Индекс (conversation_id, timestamp, id): страница диалога — диапазон индекса
+    # в хронологическом порядке, без просмотра и сортировки всей таблицы сообщений
+    __table_args__ = (db.Index('ix_messages_conversation', 'conversation_id', 'timestamp', 'id'),)
 
     def __repr__(self):
         return f'<Message {self.id}>'
 
-# Главная страница: список всех пользователей
+# Блок архива: до ARCHIVE_BLOCK_SIZE подряд идущих старых сообщений одного диалога,
+# сжатых zlib в JSON-список [id, sender_id, recipient_id, content, timestamp]
+# Блок находится по индексу (conversation_id, last_at, last_id) — позиции его последнего сообщения
+class MessageArchive(db.Model):
+    __tablename__ = 'message_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
+    # Первое и последнее сообщения блока в порядке (timestamp, id)
+    first_at = db.Column(db.DateTime, nullable=False)
+    first_id = db.Column(db.Integer, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (db.Index('ix_message_archive_conversation', 'conversation_id', 'last_at', 'last_id'),)
+
+# Рассылка: одно сообщение от отправителя многим получателям
+# Получатели фиксируются при создании рассылки в broadcast_recipients и обрабатываются
+# по возрастанию id; last_recipient_id — курсор уже отправленной части, он меняется в той же
+# транзакции, что и сообщения порции, поэтому прерванную рассылку можно продолжить без повторов
+class Broadcast(db.Model):
+    __tablename__ = 'broadcasts'
+    id = db.Column(db.Integer, primary_key=True)
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Прогресс: всего получателей, отправлено сообщений и id последнего обработанного получателя
+    total = db.Column(db.Integer, nullable=False, default=0)
+    sent = db.Column(db.Integer, nullable=False, default=0)
+    last_recipient_id = db.Column(db.Integer, nullable=False, default=0)
+    # finished_at — время завершения; пока рассылка не завершена, поле пустое
+    finished_at = db.Column(db.DateTime)
+
+    def progress(self):
+        return {'id': self.id, 'sender_id': self.sender_id, 'total': self.total, 'sent': self.sent,
+                'last_recipient_id': self.last_recipient_id,
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None}
+
+# Получатели рассылки: первичный ключ (broadcast_id, user_id) — порция берётся диапазоном индекса
+class BroadcastRecipient(db.Model):
+    __tablename__ = 'broadcast_recipients'
+    broadcast_id = db.Column(db.Integer, db.ForeignKey('broadcasts.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+
+# Сообщение, прочитанное из архива (те же поля, что и у строк страницы диалога)
+ArchivedMessage = namedtuple('ArchivedMessage', ['id', 'sender_id', 'recipient_id', 'content', 'timestamp'])
+
+def pack_messages(messages):
+    return zlib.compress(json.dumps(
+        [[m.id, m.sender_id, m.recipient_id, m.content, m.timestamp.isoformat()] for m in messages],
+        ensure_ascii=False).encode('utf-8'))
+
+def unpack_block(block):
+    messages = archive_cache.get(block.id)
+    if messages is None:
+        messages = [ArchivedMessage(id, sender_id, recipient_id, content, datetime.fromisoformat(timestamp))
+                    for id, sender_id, recipient_id, content, timestamp
+                    in json.loads(zlib.decompress(block.data))]
+        archive_cache.set(block.id, messages)
+    return messages
+
+# До limit архивных сообщений диалога перед позицией before = (timestamp, id), от новых к старым
+# Блоки читаются по индексу с конца; обычно для страницы достаточно одного-двух блоков
+def archived_messages_before(conversation_id, before, limit):
+    query = MessageArchive.query.filter(MessageArchive.conversation_id == conversation_id)
+    if before is not None:
+        query = query.filter(tuple_(MessageArchive.first_at, MessageArchive.first_id) < before)
+    messages = []
+    for block in query.order_by(MessageArchive.last_at.desc(), MessageArchive.last_id.desc()).yield_per(1):
+        for message in reversed(unpack_block(block)):
+            if before is None or (message.timestamp, message.id) < before:
+                messages.append(message)
+                if len(messages) == limit:
+                    return messages
+    return messages
+
+# Упорядоченная пара пользователей диалога
+def conversation_key(user1_id, user2_id):
+    return min(user1_id, user2_id), max(user1_id, user2_id)
+
+# id диалога двух пользователей или None, если они ещё не переписывались
+def find_conversation_id(user1_id, user2_id):
+    low, high = conversation_key(user1_id, user2_id)
+    return db.session.query(Conversation.id).filter_by(user_low_id=low, user_high_id=high).scalar()
+
+# Канал брокера для диалога двух пользователей
+def conversation_channel(user1_id, user2_id):
+    return 'conversation:%d-%d' % conversation_key(user1_id, user2_id)
+
+# Находим или создаём диалог в текущей транзакции
+# INSERT ... ON CONFLICT DO NOTHING RETURNING id не падает, если диалог одновременно создаёт
+# другой запрос; при конфликте id существующего диалога читается по уникальному индексу
+# Вместе с новым диалогом создаются строки его участников
+def get_or_create_conversation_id(user1_id, user2_id):
+    low, high = conversation_key(user1_id, user2_id)
+    conversation_id = db.session.execute(
+        sqlite_insert(Conversation)
+        .values(user_low_id=low, user_high_id=high)
+        .on_conflict_do_nothing(index_elements=['user_low_id', 'user_high_id'])
+        .returning(Conversation.id)
+    ).scalar()
+    if conversation_id is None:
+        return find_conversation_id(low, high)
+    db.session.execute(
+        sqlite_insert(ConversationMember).on_conflict_do_nothing(),
+        [{'user_id': low, 'conversation_id': conversation_id, 'peer_id': high},
+         {'user_id': high, 'conversation_id': conversation_id, 'peer_id': low}],
+    )
+    return conversation_id
+
+# Отправка сообщения в текущей транзакции: сообщение, указатель на последнее сообщение диалога,
+# время последнего сообщения у участников и счётчики непрочитанных: у получателя счётчик
+# увеличивается, отправитель своё сообщение уже видел
+def send_message(sender_id, recipient_id, content):
+    conversation_id = get_or_create_conversation_id(sender_id, recipient_id)
+    message = Message(conversation_id=conversation_id, sender_id=sender_id,
+                      recipient_id=recipient_id, content=content, timestamp=datetime.utcnow())
+    db.session.add(message)
+    db.session.flush()
+    db.session.execute(update(Conversation).where(Conversation.id == conversation_id)
+                       .values(last_message_id=message.id))
+    is_sender = ConversationMember.user_id == sender_id
+    db.session.execute(
+        update(ConversationMember)
+        .where(ConversationMember.conversation_id == conversation_id)
+        .values(last_message_at=message.timestamp,
+                unread_count=case((is_sender, 0), else_=ConversationMember.unread_count + 1),
+                last_read_message_id=case((is_sender, message.id), else_=ConversationMember.last_read_message_id))
+    )
+    return message
+
+# Пользователь открыл диалог: сбрасываем счётчик непрочитанных и запоминаем последнее сообщение
+# Счётчик сначала читается по первичному ключу: если непрочитанных нет, в базу ничего не пишется
+# и блокировка записи не берётся
+def mark_read(user_id, conversation_id):
+    unread_count = db.session.query(ConversationMember.unread_count) \
+        .filter_by(user_id=user_id, conversation_id=conversation_id).scalar()
+    if not unread_count:
+        return 0
+    result = db.session.execute(
+        update(ConversationMember)
+        .where(ConversationMember.user_id == user_id,
+               ConversationMember.conversation_id == conversation_id,
+               ConversationMember.unread_count > 0)
+        .values(unread_count=0,
+                last_read_message_id=db.session.query(Conversation.last_message_id)
+                .filter(Conversation.id == conversation_id).scalar_subquery())
+    )
+    db.session.commit()
+    return result.rowcount
+
+# Создание рассылки: получатели — перечисленные id или, только при recipient_ids=None,
+# все пользователи, кроме отправителя
+# Список получателей записывается одной командой INSERT ... SELECT из таблицы пользователей
+# Если в явном списке не осталось ни одного получателя, рассылка не создаётся: возвращается None
+def create_broadcast(sender_id, content, recipient_ids=None):
+    recipients = db.select(User.id).where(User.id != sender_id)
+    if recipient_ids is not None:
+        # Повторы и сам отправитель отбрасываются; несуществующие id — тоже
+        recipients = recipients.where(User.id.in_(set(recipient_ids)))
+        if db.session.execute(recipients.limit(1)).first() is None:
+            return None
+    broadcast = Broadcast(sender_id=sender_id, content=content)
+    db.session.add(broadcast)
+    db.session.flush()
+    db.session.execute(insert(BroadcastRecipient).from_select(
+        ['broadcast_id', 'user_id'], recipients.with_only_columns(db.literal(broadcast.id), User.id)))
+    broadcast.total = db.session.query(db.func.count()).select_from(BroadcastRecipient) \
+        .filter_by(broadcast_id=broadcast.id).scalar()
+    db.session.commit()
+    return broadcast
+
+# Отправка порции рассылки в текущей транзакции: получатели с id в диапазоне (after, upto]
+# Вместо send_message на каждого получателя — несколько команд на всю порцию, данные не покидают базу:
+# диалоги и участники (INSERT ... SELECT ... ON CONFLICT DO NOTHING), сообщения (INSERT ... SELECT),
+# указатели на последние сообщения и время последнего сообщения со счётчиками непрочитанных
+# (UPDATE ... FROM по сообщениям порции); возвращает пары (id сообщения, id получателя)
+# Сообщения порции — диапазон первичного ключа после last_id: транзакция порции уже держит
+# блокировку записи (курсор рассылки сдвинут в run_broadcast), других новых сообщений в нём нет
+def send_broadcast_chunk(broadcast, after, upto):
+    params = {'broadcast': broadcast.id, 'sender': broadcast.sender_id, 'content': broadcast.content,
+              'after': after, 'upto': upto, 'now': datetime.utcnow(),
+              'last_id': db.session.query(db.func.max(Message.id)).scalar() or 0}
+    recipients = ('FROM broadcast_recipients r '
+                  'WHERE r.broadcast_id = :broadcast AND r.user_id > :after AND r.user_id <= :upto')
+    with_conversation = (
+        'FROM broadcast_recipients r JOIN conversations c '
+        'ON c.user_low_id = MIN(:sender, r.user_id) AND c.user_high_id = MAX(:sender, r.user_id) '
+        'WHERE r.broadcast_id = :broadcast AND r.user_id > :after AND r.user_id <= :upto')
+    # Время передаётся с типом DateTime, чтобы оно хранилось в том же формате, что и через ORM
+    now = db.bindparam('now', type_=db.DateTime)
+    statements = [
+        text('INSERT INTO conversations (user_low_id, user_high_id) '
+             'SELECT MIN(:sender, r.user_id), MAX(:sender, r.user_id) ' + recipients + ' '
+             'ON CONFLICT DO NOTHING'),
+        text('INSERT INTO conversation_members (user_id, conversation_id, peer_id, last_message_at, unread_count) '
+             'SELECT :sender, c.id, r.user_id, :now, 0 ' + with_conversation + ' '
+             'UNION ALL '
+             'SELECT r.user_id, c.id, :sender, :now, 0 ' + with_conversation + ' '
+             'ON CONFLICT DO NOTHING').bindparams(now),
+        text('INSERT INTO messages (conversation_id, sender_id, recipient_id, content, timestamp) '
+             'SELECT c.id, :sender, r.user_id, :content, :now ' + with_conversation + ' '
+             'ORDER BY r.user_id').bindparams(now),
+        text('UPDATE conversations SET last_message_id = m.id '
+             'FROM messages m WHERE m.id > :last_id AND m.conversation_id = conversations.id'),
+        # Как в send_message: у получателя счётчик растёт, отправитель своё сообщение уже видел
+        # Участники находятся по первичному ключу (user_id, conversation_id), отдельно получатели
+        # и отправитель, поэтому порция не просматривает всю таблицу участников
+        text('UPDATE conversation_members SET last_message_at = :now, unread_count = unread_count + 1 '
+             'FROM messages m WHERE m.id > :last_id AND conversation_members.user_id = m.recipient_id '
+             'AND conversation_members.conversation_id = m.conversation_id').bindparams(now),
+        text('UPDATE conversation_members SET last_message_at = :now, unread_count = 0, last_read_message_id = ('
+             '  SELECT c.last_message_id FROM conversations c WHERE c.id = conversation_members.conversation_id) '
+             'WHERE user_id = :sender AND conversation_id IN ('
+             '  SELECT m.conversation_id FROM messages m WHERE m.id > :last_id)').bindparams(now),
+    ]
+    for statement in statements:
+        db.session.execute(statement, params)
+    return db.session.execute(
+        db.select(Message.id, Message.recipient_id).where(Message.id > params['last_id']).order_by(Message.id)
+    ).all()
+
+# Отправка рассылки порциями по chunk_size получателей, начиная с курсора last_recipient_id
+# Курсор сдвигается условным UPDATE в начале транзакции порции: если рассылку одновременно
+# продолжает другой процесс, UPDATE не найдёт строку и порция не будет отправлена дважды
+# progress(broadcast) вызывается после фиксации каждой порции
+def run_broadcast(broadcast_id, chunk_size=BROADCAST_CHUNK_SIZE, progress=None):
+    while True:
+        broadcast = db.session.get(Broadcast, broadcast_id, populate_existing=True)
+        if broadcast.finished_at is not None:
+            return broadcast
+        recipient_ids = db.session.scalars(
+            db.select(BroadcastRecipient.user_id)
+            .where(BroadcastRecipient.broadcast_id == broadcast_id,
+                   BroadcastRecipient.user_id > broadcast.last_recipient_id)
+            .order_by(BroadcastRecipient.user_id).limit(chunk_size)
+        ).all()
+        after = broadcast.last_recipient_id
+        if not recipient_ids:
+            db.session.execute(update(Broadcast).where(Broadcast.id == broadcast_id, Broadcast.finished_at.is_(None))
+                               .values(finished_at=datetime.utcnow()))
+            db.session.commit()
+            continue
+        claimed = db.session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.last_recipient_id == after)
+            .values(last_recipient_id=recipient_ids[-1], sent=Broadcast.sent + len(recipient_ids))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            db.session.rollback()
+            continue
+        messages = send_broadcast_chunk(broadcast, after, recipient_ids[-1])
+        db.session.commit()
+        # Будим long-poll запросы открытых диалогов с отправителем
+        for message_id, recipient_id in messages:
+            message_events.publish(conversation_channel(broadcast.sender_id, recipient_id), 'message', {'id': message_id})
+        if progress is not None:
+            progress(db.session.get(Broadcast, broadcast_id, populate_existing=True))
+
+# Главная страница: постраничный список пользователей со ссылками на их входящие
 @app.route('/')
 def index():
-    # Получаем всех пользователей из базы данных
-    users = User.query.all()
-    # Передаём список пользователей в шаблон
-    return render_template('index.html', users=users)
+    # Курсор keyset-пагинации: id последнего пользователя предыдущей страницы
+    after = request.args.get('after', 0, type=int)
+    # Берём на одного пользователя больше, чтобы понять, есть ли следующая страница
+    users = (db.session.query(User.id, User.username).filter(User.id > after)
+             .order_by(User.id).limit(USERS_PER_PAGE + 1).all())
+    next_after = users[USERS_PER_PAGE - 1].id if len(users) > USERS_PER_PAGE else None
+    # Передаём страницу пользователей в шаблон
+    return render_template('index.html', users=users[:USERS_PER_PAGE], next_after=next_after)
+
+# Входящие пользователя: диалоги от самого свежего с последним сообщением и временем
+# Один запрос по индексу участников диалогов; keyset-пагинация по (last_message_at, conversation_id)
+@app.route('/inbox/<int:user_id>')
+def inbox(user_id):
+    user = User.query.get_or_404(user_id)
+    query = (db.session.query(ConversationMember.conversation_id, ConversationMember.last_message_at,
+                              ConversationMember.peer_id, ConversationMember.unread_count,
+                              User.username.label('peer_username'),
+                              Message.sender_id, Message.content)
+             .join(User, User.id == ConversationMember.peer_id)
+             .join(Conversation, Conversation.id == ConversationMember.conversation_id)
+             .join(Message, Message.id == Conversation.last_message_id)
+             .filter(ConversationMember.user_id == user.id))
+    before_at = request.args.get('before_at')
+    before_id = request.args.get('before_id', type=int)
+    if before_at and before_id:
+        try:
+            before_at = datetime.fromisoformat(before_at)
+        except ValueError:
+            return redirect(url_for('inbox', user_id=user.id))
+        query = query.filter(tuple_(ConversationMember.last_message_at, ConversationMember.conversation_id)
+                             < (before_at, before_id))
+    # Берём на один диалог больше, чтобы понять, есть ли следующая страница
+    conversations = (query.order_by(ConversationMember.last_message_at.desc(),
+                                    ConversationMember.conversation_id.desc())
+                     .limit(CONVERSATIONS_PER_PAGE + 1).all())
+    next_page = None
+    if len(conversations) > CONVERSATIONS_PER_PAGE:
+        conversations = conversations[:CONVERSATIONS_PER_PAGE]
+        last = conversations[-1]
+        next_page = {'before_at': last.last_message_at.isoformat(), 'before_id': last.conversation_id}
+    return render_template('inbox.html', user=user, conversations=conversations, next_page=next_page,
+                           preview_length=PREVIEW_LENGTH)
+
+# Непрочитанные сообщения пользователя: ?user_id=<id>
+# Общее число и диалоги с непрочитанными — один запрос по частичному индексу, только строки
+# с unread_count > 0, поэтому клиенты могут опрашивать его часто
+@app.route('/unread')
+def unread():
+    user_id = request.args.get('user_id', type=int)
+    if user_id is None:
+        return jsonify(error='Не указан user_id'), 400
+    rows = (db.session.query(ConversationMember.conversation_id, ConversationMember.peer_id,
+                             ConversationMember.unread_count, ConversationMember.last_read_message_id)
+            .filter(ConversationMember.user_id == user_id, ConversationMember.unread_count > 0)
+            .all())
+    return jsonify(
+        total=sum(row.unread_count for row in rows),
+        conversations=[{'conversation_id': row.conversation_id, 'peer_id': row.peer_id,
+                        'unread': row.unread_count, 'last_read_message_id': row.last_read_message_id,
+                        'url': url_for('dialog', user1_id=user_id, user2_id=row.peer_id)} for row in rows],
+    )
+
+# Начать диалог из входящих: собеседник выбирается по имени
+@app.route('/inbox/<int:user_id>/start')
+def start_dialog(user_id):
+    user = User.query.get_or_404(user_id)
+    peer_id = db.session.query(User.id).filter_by(username=request.args.get('username', '')).scalar()
+    if peer_id is None:
+        flash('Пользователь не найден!')
+        return redirect(url_for('inbox', user_id=user.id))
+    return redirect(url_for('dialog', user1_id=user.id, user2_id=peer_id))
 
 # Страница регистрации нового пользователя
 @app.route('/register', methods=['GET', 'POST'])
@@ -93,17 +515,267 @@ def dialog(user1_id, user2_id):
         if not content:
             flash('Сообщение не может быть пустым!')
             return redirect(url_for('dialog', user1_id=user1_id, user2_id=user2_id))
-        message = Message(sender_id=user1.id, recipient_id=user2.id, content=content)
-        db.session.add(message)
+        message = send_message(user1.id, user2.id, content)
+        message_id = message.id
         db.session.commit()
+        # Будим ожидающих long-poll запросов только после фиксации: они сразу прочитают сообщение
+        message_events.publish(conversation_channel(user1.id, user2.id), 'message', {'id': message_id})
         flash('Сообщение отправлено!')
         return redirect(url_for('dialog', user1_id=user1_id, user2_id=user2_id))
-    # Получаем все сообщения между двумя пользователями (в обе стороны), сортируем по времени
-    messages = Message.query.filter(
-        ((Message.sender_id == user1.id) & (Message.recipient_id == user2.id)) |
-        ((Message.sender_id == user2.id) & (Message.recipient_id == user1.id))
-    ).order_by(Message.timestamp).all()
-    return render_template('dialog.html', user1=user1, user2=user2, messages=messages)
+    # Курсор «более ранние сообщения»: время и id самого раннего сообщения текущей страницы
+    before_at = request.args.get('before_at')
+    before_id = request.args.get('before_id', type=int)
+    messages, older = [], None
+    conversation_id = find_conversation_id(user1.id, user2.id)
+    if conversation_id is not None:
+        mark_read(user1.id, conversation_id)
+        query = db.session.query(Message.id, Message.sender_id, Message.content, Message.timestamp) \
+            .filter(Message.conversation_id == conversation_id)
+        if before_at and before_id:
+            try:
+                before_at = datetime.fromisoformat(before_at)
+            except ValueError:
+                return redirect(url_for('dialog', user1_id=user1_id, user2_id=user2_id))
+            query = query.filter(tuple_(Message.timestamp, Message.id) < (before_at, before_id))
+        # Читаем последние сообщения по индексу с конца и берём на одно больше,
+        # чтобы понять, есть ли более ранние; на странице выводим их в хронологическом порядке
+        rows = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(MESSAGES_PER_PAGE + 1).all()
+        # Если рабочая таблица закончилась, продолжаем страницу сообщениями из архива
+        if len(rows) <= MESSAGES_PER_PAGE:
+            if rows:
+                before = (rows[-1].timestamp, rows[-1].id)
+            else:
+                before = (before_at, before_id) if before_id else None
+            rows += archived_messages_before(conversation_id, before, MESSAGES_PER_PAGE + 1 - len(rows))
+        messages = rows[:MESSAGES_PER_PAGE][::-1]
+        if len(rows) > MESSAGES_PER_PAGE:
+            first = messages[0]
+            older = {'before_at': first.timestamp.isoformat(), 'before_id': first.id}
+    return render_template('dialog.html', user1=user1, user2=user2, messages=messages,
+                           older=older, is_latest=not before_id)
+
+# Сообщения диалога после сообщения since_id в порядке индекса (timestamp, id)
+# Позиция since_id находится по первичному ключу, дальше — диапазон индекса диалога
+def messages_since(conversation_id, since_id):
+    query = db.session.query(Message.id, Message.sender_id, Message.content, Message.timestamp) \
+        .filter(Message.conversation_id == conversation_id)
+    since_at = db.session.query(Message.timestamp).filter_by(id=since_id).scalar() if since_id else None
+    if since_at is not None:
+        query = query.filter(tuple_(Message.timestamp, Message.id) > (since_at, since_id))
+    else:
+        query = query.filter(Message.id > since_id)
+    return query.order_by(Message.timestamp, Message.id).limit(MESSAGES_PER_PAGE).all()
+
+# Long-poll доставка новых сообщений диалога: ?since_id=<id последнего полученного сообщения>
+# Если новых сообщений нет, запрос ждёт их до POLL_TIMEOUT секунд, не держа соединение с базой
+# Ожидание не занимает поток при запуске под gevent (gunicorn -k gevent), см. common/pubsub.py
+@app.route('/dialog/<int:user1_id>/<int:user2_id>/poll')
+def poll_messages(user1_id, user2_id):
+    since_id = request.args.get('since_id', 0, type=int)
+    # Подписываемся до чтения базы, чтобы не пропустить сообщение, отправленное между чтением и ожиданием
+    with message_events.subscribe(conversation_channel(user1_id, user2_id)) as subscription:
+        conversation_id = find_conversation_id(user1_id, user2_id)
+        messages = messages_since(conversation_id, since_id) if conversation_id else []
+        if not messages:
+            # Возвращаем соединение в пул на время ожидания
+            db.session.close()
+            if subscription.get(timeout=POLL_TIMEOUT):
+                conversation_id = conversation_id or find_conversation_id(user1_id, user2_id)
+                messages = messages_since(conversation_id, since_id)
+    # Доставленные на открытую страницу диалога сообщения считаются прочитанными
+    if messages:
+        mark_read(user1_id, conversation_id)
+    return jsonify(
+        messages=[{'id': m.id, 'sender_id': m.sender_id, 'content': m.content,
+                   'timestamp': m.timestamp.isoformat()} for m in messages],
+        since_id=messages[-1].id if messages else since_id,
+    )
+
+# Рассылка: POST sender_id, content и, необязательно, несколько recipient_id
+# Всем пользователям рассылка уходит, только если поля recipient_id в запросе нет совсем;
+# нечисловой id или список, в котором не нашлось ни одного получателя, — ошибка 400
+# Рассылка отправляется порциями сразу в этом запросе; ответ — её прогресс
+# Если запрос прервался, рассылку продолжает POST /broadcast/<id>/resume или flask resume-broadcast
+@app.route('/broadcast', methods=['POST'])
+def broadcast():
+    sender_id = request.form.get('sender_id', type=int)
+    if sender_id is None:
+        return jsonify(error='Не указан sender_id'), 400
+    sender = User.query.get_or_404(sender_id)
+    content = request.form.get('content')
+    if not content:
+        return jsonify(error='Сообщение не может быть пустым'), 400
+    recipient_ids = None
+    if 'recipient_id' in request.form:
+        try:
+            recipient_ids = [int(value) for value in request.form.getlist('recipient_id')]
+        except ValueError:
+            return jsonify(error='Некорректный recipient_id'), 400
+    broadcast = create_broadcast(sender.id, content, recipient_ids)
+    if broadcast is None:
+        return jsonify(error='Получатели не найдены'), 400
+    broadcast = run_broadcast(broadcast.id)
+    return jsonify(broadcast.progress()), 201, {'Location': url_for('broadcast_status', broadcast_id=broadcast.id)}
+
+# Прогресс рассылки
+@app.route('/broadcast/<int:broadcast_id>')
+def broadcast_status(broadcast_id):
+    return jsonify(Broadcast.query.get_or_404(broadcast_id).progress())
+
+# Продолжение прерванной рассылки с последней зафиксированной порции
+@app.route('/broadcast/<int:broadcast_id>/resume', methods=['POST'])
+def resume_broadcast_request(broadcast_id):
+    Broadcast.query.get_or_404(broadcast_id)
+    return jsonify(run_broadcast(broadcast_id).progress())
+
+# Команда переноса существующих сообщений в диалоги (для баз, созданных до появления диалогов)
+# Добавляет столбец conversation_id, создаёт диалоги для всех пар переписывавшихся пользователей
+# и проставляет диалог каждому сообщению
+# Запуск: flask --app app backfill-conversations
+@app.cli.command('backfill-conversations')
+def backfill_conversations():
+    db.create_all()
+    columns = [row[1] for row in db.session.execute(text('PRAGMA table_info(messages)'))]
+    if 'conversation_id' not in columns:
+        db.session.execute(text('ALTER TABLE messages ADD COLUMN conversation_id INTEGER REFERENCES conversations(id)'))
+    db.session.execute(text(
+        'INSERT OR IGNORE INTO conversations (user_low_id, user_high_id) '
+        'SELECT DISTINCT MIN(sender_id, recipient_id), MAX(sender_id, recipient_id) FROM messages'
+    ))
+    db.session.execute(text(
+        'UPDATE messages SET conversation_id = ('
+        '  SELECT c.id FROM conversations c'
+        '  WHERE c.user_low_id = MIN(messages.sender_id, messages.recipient_id)'
+        '    AND c.user_high_id = MAX(messages.sender_id, messages.recipient_id)'
+        ') WHERE conversation_id IS NULL'
+    ))
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_messages_conversation ON messages (conversation_id, timestamp, id)'
+    ))
+    db.session.commit()
+    print('Сообщения распределены по диалогам')
+
+# Команда пересчёта входящих: указатели на последние сообщения диалогов и строки участников
+# Запуск: flask --app app rebuild-inbox
+@app.cli.command('rebuild-inbox')
+def rebuild_inbox():
+    db.session.execute(text(
+        'UPDATE conversations SET last_message_id = ('
+        '  SELECT m.id FROM messages m WHERE m.conversation_id = conversations.id'
+        '  ORDER BY m.timestamp DESC, m.id DESC LIMIT 1)'
+    ))
+    db.session.execute(text(
+        'INSERT INTO conversation_members (user_id, conversation_id, peer_id, last_message_at) '
+        'SELECT c.user_low_id, c.id, c.user_high_id, m.timestamp '
+        'FROM conversations c JOIN messages m ON m.id = c.last_message_id '
+        'UNION ALL '
+        'SELECT c.user_high_id, c.id, c.user_low_id, m.timestamp '
+        'FROM conversations c JOIN messages m ON m.id = c.last_message_id '
+        'WHERE c.user_high_id != c.user_low_id '
+        # Счётчики непрочитанных у существующих строк сохраняются
+        'ON CONFLICT (user_id, conversation_id) DO UPDATE SET '
+        'peer_id = excluded.peer_id, last_message_at = excluded.last_message_at'
+    ))
+    db.session.commit()
+    print('Входящие пересчитаны')
+
+# Команда пересчёта счётчиков непрочитанных: сообщения собеседника после last_read_message_id
+# (для баз, созданных до появления счётчиков, — все сообщения собеседника)
+# Запуск: flask --app app rebuild-unread-counters
+@app.cli.command('rebuild-unread-counters')
+def rebuild_unread_counters():
+    db.session.execute(text(
+        'UPDATE conversation_members SET unread_count = ('
+        '  SELECT COUNT(*) FROM messages m'
+        '  WHERE m.conversation_id = conversation_members.conversation_id'
+        '    AND m.sender_id != conversation_members.user_id'
+        '    AND m.id > COALESCE(conversation_members.last_read_message_id, 0))'
+    ))
+    db.session.commit()
+    print('Счётчики непрочитанных пересчитаны')
+
+# Команда архивации: сообщения старше --days дней переносятся из таблицы messages в сжатые блоки
+# Диалоги обрабатываются по одному, каждый — отдельной транзакцией: блоки добавляются,
+# перенесённые сообщения удаляются. Последнее сообщение диалога остаётся в таблице
+# (на него ссылаются входящие), поэтому архив диалога всегда старше его рабочих сообщений
+# --vacuum после архивации возвращает освободившееся место файлу базы
+# Запуск: flask --app app archive-messages --days 180
+@app.cli.command('archive-messages')
+@click.option('--days', default=ARCHIVE_AFTER_DAYS, show_default=True, help='Возраст сообщений в днях')
+@click.option('--vacuum', is_flag=True, help='Сжать файл базы после архивации')
+def archive_messages(days, vacuum):
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    conversation_ids = db.session.execute(text(
+        'SELECT DISTINCT conversation_id FROM messages WHERE timestamp < :cutoff'), {'cutoff': cutoff}).scalars().all()
+    archived = raw_size = packed_size = 0
+    for conversation_id in conversation_ids:
+        last_message_id = db.session.query(Conversation.last_message_id).filter_by(id=conversation_id).scalar()
+        condition = (Message.conversation_id == conversation_id, Message.timestamp < cutoff,
+                     Message.id != last_message_id)
+        # Сообщения читаются по индексу диалога порциями по размеру блока
+        rows = db.session.execute(
+            db.select(Message.id, Message.sender_id, Message.recipient_id, Message.content, Message.timestamp)
+            .where(*condition).order_by(Message.timestamp, Message.id)
+            .execution_options(yield_per=ARCHIVE_BLOCK_SIZE)
+        )
+        blocks = []
+        for block in rows.partitions():
+            data = pack_messages(block)
+            blocks.append({'conversation_id': conversation_id, 'first_at': block[0].timestamp,
+                           'first_id': block[0].id, 'last_at': block[-1].timestamp, 'last_id': block[-1].id,
+                           'message_count': len(block), 'data': data})
+            raw_size += sum(len(m.content.encode('utf-8')) for m in block)
+            packed_size += len(data)
+        if blocks:
+            db.session.execute(MessageArchive.__table__.insert(), blocks)
+            db.session.execute(Message.__table__.delete().where(*condition))
+            archived += sum(block['message_count'] for block in blocks)
+        db.session.commit()
+    print(f'В архив перенесено сообщений: {archived} из {len(conversation_ids)} диалогов; '
+          f'текст {raw_size} байт → блоки {packed_size} байт')
+    if vacuum:
+        # VACUUM нельзя выполнить внутри транзакции
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text('VACUUM'))
+        print('Файл базы сжат')
+
+# Вывод прогресса рассылки в командах send-broadcast и resume-broadcast
+def print_broadcast_progress(broadcast):
+    print(f'Рассылка {broadcast.id}: отправлено {broadcast.sent} из {broadcast.total}')
+
+# Команда рассылки: сообщение от пользователя USERNAME всем пользователям или перечисленным в --to
+# Запуск: flask --app app send-broadcast admin "Текст объявления" [--to alice --to bob]
+@app.cli.command('send-broadcast')
+@click.argument('username')
+@click.argument('content')
+@click.option('--to', 'recipients', multiple=True, help='Имя получателя (можно указать несколько раз)')
+@click.option('--chunk-size', default=BROADCAST_CHUNK_SIZE, show_default=True, help='Получателей в транзакции')
+def send_broadcast(username, content, recipients, chunk_size):
+    sender_id = db.session.query(User.id).filter_by(username=username).scalar()
+    if sender_id is None:
+        raise click.ClickException('Пользователь не найден!')
+    recipient_ids = None
+    if recipients:
+        recipient_ids = db.session.scalars(db.select(User.id).where(User.username.in_(recipients))).all()
+    broadcast = create_broadcast(sender_id, content, recipient_ids)
+    if broadcast is None:
+        raise click.ClickException('Получатели не найдены!')
+    print(f'Рассылка {broadcast.id} создана, получателей: {broadcast.total}')
+    run_broadcast(broadcast.id, chunk_size, progress=print_broadcast_progress)
+    print('Рассылка завершена')
+
+# Команда продолжения прерванной рассылки: отправляются только ещё не обработанные получатели
+# Запуск: flask --app app resume-broadcast 1
+@app.cli.command('resume-broadcast')
+@click.argument('broadcast_id', type=int)
+@click.option('--chunk-size', default=BROADCAST_CHUNK_SIZE, show_default=True, help='Получателей в транзакции')
+def resume_broadcast(broadcast_id, chunk_size):
+    broadcast = db.session.get(Broadcast, broadcast_id)
+    if broadcast is None:
+        raise click.ClickException('Рассылка не найдена!')
+    print_broadcast_progress(broadcast)
+    run_broadcast(broadcast_id, chunk_size, progress=print_broadcast_progress)
+    print('Рассылка завершена')
 
 # Запуск приложения только если файл запущен напрямую
 if __name__ == '__main__':
@@ -0,0 +1,98 @@
+# Бенчмарк рассылки
+# Заполняет временную базу --users пользователями и измеряет:
+# - рассылку всем пользователям порциями (run_broadcast);
+# - отправку тех же сообщений по одному (send_message + commit на каждого получателя) на --single получателях;
+# - прерывание рассылки посередине и её продолжение (resume-broadcast);
+# и проверяет, что каждому получателю ушло ровно одно сообщение, а счётчики непрочитанных
+# совпадают с пересчитанными с нуля
+#
+# Запуск из каталога messanger:
+#     python bench_broadcast.py --users 100000
+# Бенчмарк работает с временной базой данных и не трогает messanger.db
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# Разбираем аргументы командной строки
+parser = argparse.ArgumentParser(description='Бенчмарк рассылки')
+parser.add_argument('--users', type=int, default=100000, help='число пользователей')
+parser.add_argument('--single', type=int, default=2000, help='число получателей при отправке по одному')
+parser.add_argument('--chunk-size', type=int, default=2000, help='получателей в транзакции')
+args = parser.parse_args()
+
+# Подключаем приложение к временной базе до его импорта
+db_dir = tempfile.mkdtemp()
+os.environ['MESSANGER_DATABASE_URI'] = 'sqlite:///' + os.path.join(db_dir, 'bench.db')
+
+from sqlalchemy import insert, text
+from app import app, db, User, Message, Broadcast, create_broadcast, run_broadcast, send_message
+
+# Заполняем базу пакетной вставкой
+with app.app_context():
+    db.create_all()
+    db.session.execute(insert(User), [{'username': f'user{i}'} for i in range(args.users)])
+    db.session.commit()
+print(f'База: {args.users} пользователей')
+
+# Рассылка всем пользователям от первого
+with app.app_context():
+    started = time.perf_counter()
+    broadcast_id = create_broadcast(1, 'Объявление').id
+    run_broadcast(broadcast_id, args.chunk_size)
+    elapsed = time.perf_counter() - started
+    total = db.session.get(Broadcast, broadcast_id).total
+print(f'Рассылка на {total} получателей: {elapsed:.2f} с ({total / elapsed:.0f} сообщений/с)')
+
+# Те же сообщения по одному от второго пользователя: транзакция на каждого получателя
+with app.app_context():
+    started = time.perf_counter()
+    for recipient_id in range(3, args.single + 3):
+        send_message(2, recipient_id, 'Объявление')
+        db.session.commit()
+    elapsed = time.perf_counter() - started
+print(f'По одному: {args.single / elapsed:.0f} сообщений/с, '
+      f'на {total} получателей ушло бы {total / args.single * elapsed:.0f} с')
+
+# Прерываем рассылку после трёх порций и продолжаем её командой resume-broadcast
+class Interrupted(Exception):
+    pass
+
+def interrupt_after(chunks):
+    def progress(broadcast):
+        if broadcast.sent >= chunks * args.chunk_size:
+            raise Interrupted
+    return progress
+
+with app.app_context():
+    broadcast_id = create_broadcast(3, 'Прерванное объявление').id
+    try:
+        run_broadcast(broadcast_id, args.chunk_size, progress=interrupt_after(3))
+    except Interrupted:
+        pass
+    sent = db.session.get(Broadcast, broadcast_id).sent
+print(f'Рассылка прервана: отправлено {sent}')
+result = app.test_cli_runner().invoke(args=['resume-broadcast', str(broadcast_id),
+                                            '--chunk-size', str(args.chunk_size)])
+assert result.exit_code == 0, result.output
+print(result.output.strip().splitlines()[-2])
+
+# Проверка: по одному сообщению каждой рассылки на получателя и счётчики непрочитанных
+with app.app_context():
+    duplicates = db.session.execute(text(
+        'SELECT COUNT(*) FROM (SELECT 1 FROM messages '
+        'GROUP BY sender_id, recipient_id, content HAVING COUNT(*) > 1)')).scalar()
+    missing = total - db.session.query(Message).filter_by(content='Прерванное объявление').count()
+    counters = dict(((row[0], row[1]), row[2]) for row in db.session.execute(text(
+        'SELECT user_id, conversation_id, unread_count FROM conversation_members')))
+result = app.test_cli_runner().invoke(args=['rebuild-unread-counters'])
+assert result.exit_code == 0, result.output
+with app.app_context():
+    rebuilt = dict(((row[0], row[1]), row[2]) for row in db.session.execute(text(
+        'SELECT user_id, conversation_id, unread_count FROM conversation_members')))
+if duplicates or missing or counters != rebuilt:
+    print(f'ПРОВАЛ: повторов {duplicates}, не отправлено {missing}, '
+          f'счётчиков расходится {sum(counters[key] != rebuilt[key] for key in rebuilt)}')
+    sys.exit(1)
+print('OK: сообщения отправлены ровно по одному, счётчики непрочитанных совпадают с пересчитанными')
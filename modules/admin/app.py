@@ -10,6 +10,14 @@ from flask_admin import Admin
 # Импортируем ModelView для отображения моделей в админке
 from flask_admin.contrib.sqla import ModelView
 
+# os и sys — модули стандартной библиотеки для работы с путями и путём поиска модулей
+import os
+import sys
+# Добавляем корень репозитория в путь поиска модулей, чтобы подключить общий модуль common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+# configure_sqlite — общие настройки SQLite (WAL, PRAGMA, пул соединений), см. common/sqlite_engine.py
+from common.sqlite_engine import configure_sqlite
+
 # Создаём экземпляр Flask-приложения
 app = Flask(__name__)
 # Устанавливаем секретный ключ, необходимый для работы сессий и защиты от CSRF-атак
@@ -19,6 +27,9 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///admin_example.db'
 # Отключаем отслеживание изменений объектов для экономии памяти
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Включаем общие настройки SQLite до создания движка базы данных
+configure_sqlite(app)
+
 # Создаём экземпляр SQLAlchemy для работы с базой данных
 # db — объект для взаимодействия с БД
 # Документация: https://flask-sqlalchemy.palletsprojects.com/en/latest/api/
@@ -5,6 +5,14 @@ from flask import Flask, render_template, request, redirect, url_for, flash
 # Документация: https://flask-sqlalchemy.palletsprojects.com/
 from flask_sqlalchemy import SQLAlchemy
 
+# os и sys — модули стандартной библиотеки для работы с путями и путём поиска модулей
+import os
+import sys
+# Добавляем корень репозитория в путь поиска модулей, чтобы подключить общий модуль common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+# configure_sqlite — общие настройки SQLite (WAL, PRAGMA, пул соединений), см. common/sqlite_engine.py
+from common.sqlite_engine import configure_sqlite
+
 # Создаём экземпляр Flask-приложения
 app = Flask(__name__)
 # Устанавливаем секретный ключ, необходимый для работы flash-сообщений и защиты от CSRF-атак
@@ -15,6 +23,9 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///example.db'
 # Отключаем отслеживание изменений объектов для экономии памяти (опционально)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Включаем общие настройки SQLite до создания движка базы данных
+configure_sqlite(app)
+
 # Создаём экземпляр SQLAlchemy, передавая ему наше приложение
 # db — объект для работы с базой данных
 # Документация: https://flask-sqlalchemy.palletsprojects.com/en/latest/api/
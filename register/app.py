@@ -6,6 +6,11 @@ from wtforms import StringField, PasswordField, SubmitField  # Поля форм
 from wtforms.validators import DataRequired, Length, EqualTo  # Валидаторы полей
 from werkzeug.security import generate_password_hash  # Для хеширования паролей
 
+import os  # Работа с путями
+import sys  # Путь поиска модулей
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # Корень репозитория
+from common.sqlite_engine import configure_sqlite  # Общие настройки SQLite (WAL, PRAGMA, пул)
+
 # Создание Flask-приложения
 app = Flask(__name__)
 
@@ -14,6 +19,8 @@ app.config['SECRET_KEY'] = 'ваш-секретный-ключ'  # Ключ дл
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'  # Путь к SQLite базе
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Отключаем уведомления об изменениях
 
+configure_sqlite(app)  # Включаем общие настройки SQLite до создания движка
+
 # Инициализация SQLAlchemy
 db = SQLAlchemy(app)
 